@@ -7,7 +7,9 @@ import os
 import traceback
 from importlib.machinery import SourceFileLoader
 from pathlib import Path
-from typing import Any, Tuple
+from typing import Any, Optional, Tuple
+
+from knack.util import CLIError
 
 from azure_stac.commands.__command import BaseCommand
 
@@ -15,9 +17,24 @@ PROCESSORS_LIST: dict[str, Any] = {}
 
 GROUP = "processor"
 
-COMMANDS = {"run": "run_processor", "list": "list_processors"}
-
-ARGUMENTS = {"run": {"name": str}}
+COMMANDS = {
+    "run": "run_processor",
+    "list": "list_processors",
+    "backfill": "backfill_processor",
+    "bulk-load": "bulk_load_items",
+}
+
+ARGUMENTS = {
+    "run": {
+        "name": str,
+        "profile": str,
+        "profile_output": str,
+        "max_messages": int,
+        "max_run_time": float,
+    },
+    "backfill": {"name": str, "prefix": str, "inventory": str, "concurrency": int},
+    "bulk-load": {"path": str, "method": str, "batch_size": int},
+}
 
 
 class ProcessorCommand(BaseCommand):
@@ -65,18 +82,108 @@ class ProcessorCommand(BaseCommand):
 # --------------------------------#
 
 
-def run_processor(client: Any, name: str) -> None:
-    """Knack command to run the processor by name
+def run_processor(
+    client: Any,
+    name: str,
+    profile: Optional[str] = None,
+    profile_output: Optional[str] = None,
+    max_messages: Optional[int] = None,
+    max_run_time: Optional[float] = None,
+) -> None:
+    """Knack command to run the processor by name, optionally under a profiler
     :param client: Processor Client instantiated at runtime by the Client Factory based
         on the specified processor to run
     :type client: BaseProcessor
     :param name: Name of the processor to run
     :type name: str
+    :param profile: Optional profiler to run the processor under, cprofile or sampling
+    :type profile: str
+    :param profile_output: Path of the profile, defaults to {name}.pstats for cprofile
+        and to {name}.folded for sampling
+    :type profile_output: str
+    :param max_messages: Stop once this many messages were received
+    :type max_messages: int
+    :param max_run_time: Stop receiving messages after this many seconds
+    :type max_run_time: float
     :returns: None
     :rtype: None
     """
 
-    PROCESSORS_LIST[name].execute_processor()
+    # settings of the processor, only the ones given so that processors without
+    # stop limits still run
+    settings: dict[str, Any] = {}
+    if max_messages is not None:
+        settings["max_messages"] = max_messages
+    if max_run_time is not None:
+        settings["max_run_time"] = max_run_time
+
+    # cProfile only sees the main thread, the messages are processed on it instead of
+    # on a pool of workers
+    if profile == "cprofile":
+        settings["inline_handlers"] = True
+
+    if profile is None:
+        PROCESSORS_LIST[name].execute_processor(**settings)
+        return
+
+    from azure_stac.core.profiling import get_profiler
+
+    try:
+        profiler = get_profiler(profile)
+
+    except ValueError as e:
+        raise CLIError(str(e))
+
+    if profile_output is None:
+        profile_output = f"{name}.pstats" if profile == "cprofile" else f"{name}.folded"
+
+    profiler.start()
+
+    try:
+        PROCESSORS_LIST[name].execute_processor(**settings)
+
+    finally:
+        # interrupted runs are profiled too, e.g. when no stop limit was given
+        profiler.stop()
+        profiler.write(profile_output)
+
+        print(profiler.summary())
+        print(f"Profile written to {profile_output}")
+
+
+def backfill_processor(
+    client: Any,
+    name: str,
+    prefix: Optional[str] = None,
+    inventory: Optional[str] = None,
+    concurrency: Optional[int] = None,
+) -> None:
+    """Knack command to run a processor over blobs that are already in the Storage
+    Account, listed from a prefix or read from a Blob Inventory report, instead of
+    over the messages of its topic
+    :param client: Processor Client instantiated at runtime by the Client Factory
+    :type client: BaseProcessor
+    :param name: Name of the processor to run
+    :type name: str
+    :param prefix: Only process the blobs whose name starts with this prefix
+    :type prefix: str
+    :param inventory: Optional local path to a CSV or Parquet Blob Inventory report,
+        the container is listed otherwise
+    :type inventory: str
+    :param concurrency: Number of blobs processed in parallel
+    :type concurrency: int
+    :returns: None
+    :rtype: None
+    """
+
+    module = PROCESSORS_LIST[name]
+
+    if not hasattr(module, "execute_backfill"):
+        raise CLIError(f"Processor {name} does not support backfills")
+
+    processed, skipped, failed = module.execute_backfill(prefix, inventory, concurrency)
+
+    print(f"Processed {processed} blobs, skipped {skipped} already processed, {failed} failed")
 
 
 def list_processors(client: Any) -> None:
@@ -92,6 +199,31 @@ def list_processors(client: Any) -> None:
         print(processor)
 
 
+def bulk_load_items(
+    client: Any, path: str, method: str = "insert", batch_size: int = 10000
+) -> None:
+    """Knack command to bulk load STAC items from local JSON/NDJSON files to
+    PostgreSQL, meant for offline backfills
+    :param client: Processor Client instantiated at runtime by the Client Factory
+    :type client: BaseProcessor
+    :param path: Path to a JSON/NDJSON file or to a folder of such files
+    :type path: str
+    :param method: How existing items are handled: insert, ignore or upsert
+    :type method: str
+    :param batch_size: Items copied and merged per transaction
+    :type batch_size: int
+    :returns: None
+    :rtype: None
+    """
+
+    from azure_stac.common.__pypgstac import BulkItemLoader, read_items
+
+    with BulkItemLoader(method=method, batch_size=batch_size) as loader:
+        count = loader.load(read_items(path))
+
+    print(f"Loaded {count} items")
+
+
 # --------------------------------#
 # Client Factory
 # --------------------------------#
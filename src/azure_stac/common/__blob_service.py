@@ -3,162 +3,712 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+import asyncio
+import logging
 import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from types import TracebackType
+from typing import IO, Any, Coroutine, Iterable, Optional, Tuple, Type, TypeVar, Union
 
-from typing import Optional
-from azure.storage.blob.aio import BlobClient
+from azure.storage.blob.aio import BlobClient, ContainerClient, StorageStreamDownloader
 
+from azure_stac.common.__utilities import getenv
 
-async def check_if_blob_exists(conn_str: str, container_name: str, blob_name: str) -> bool:
-    """Checks if a blob exists in the storage account
-    :param conn_str: Connection String to the Storage Account hosting the Blob
-    :type conn_str: str
-    :param container_name: Name of the Container where the blob is hosted
-        in the Azure Storage Account
-    :type container_name: str
-    :param blob_name: Relative path to the blob with ref. to the container
-    :type blob_name: str
-    :returns: True if the blob exists; otherwise false
-    :rtype: bool
-    """
+T = TypeVar("T")
 
-    blob = BlobClient.from_connection_string(
-        conn_str=conn_str, container_name=container_name, blob_name=blob_name
-    )
-    async with blob:
-        exists = await blob.exists()
-        return exists
+# validity of the SAS tokens, and how long before expiry a cached token is replaced
+SAS_TOKEN_LIFETIME = timedelta(seconds=float(getenv("SAS_TOKEN_LIFETIME", "86400")))
+SAS_TOKEN_REFRESH_MARGIN = timedelta(seconds=float(getenv("SAS_TOKEN_REFRESH_MARGIN", "3600")))
 
+# memory used by the cache of downloaded blobs, and largest blob it keeps, in bytes.
+# A size of 0 disables the cache
+BLOB_CACHE_SIZE = int(getenv("BLOB_CACHE_SIZE", str(64 * 1024 * 1024)))
+BLOB_CACHE_MAX_ENTRY_SIZE = int(getenv("BLOB_CACHE_MAX_ENTRY_SIZE", str(4 * 1024 * 1024)))
 
-async def get_blob_size(conn_str: str, container_name: str, file_path: str) -> int:
-    """Get the size of the blob in Storage Account (in bytes)
-    :param conn_str: Connection String to the Storage Account hosting the Blob
-    :type conn_str: str
-    :param container_name: Name of the Container where the blob is hosted
-        in the Azure Storage Account
-    :type container_name: str
-    :param file_path: Relative path to the blob with ref. to the container
-    :type file_path: str
-    :returns: Size of the blob in bytes
-    :rtype: int
+# blobs returned per page when listing a container, 5000 is the service maximum
+LIST_PAGE_SIZE = 5000
+
+# process-wide cache of SAS tokens and their expiry, keyed by
+# (account name, permissions, resource types)
+_sas_tokens: dict[tuple[str, str, str], tuple[str, datetime]] = {}
+_sas_tokens_lock = threading.Lock()
+
+
+def _is_not_modified_noise(record: logging.LogRecord) -> bool:
+    # the SDK warns about the empty body of every 304 Not Modified response
+    return not record.getMessage().startswith("Unexpected return type")
+
+
+logging.getLogger("azure.storage.blob._shared.response_handlers").addFilter(
+    _is_not_modified_noise
+)
+
+
+class BlobCache:
+    """Size-bounded LRU cache of blob contents along with their ETag. Entries are
+    revalidated with a conditional GET before being served, so a hit saves the
+    transfer of the content but not the round trip. Not thread-safe, it's only
+    used from the event loop of its BlobService
     """
 
-    async with BlobClient.from_connection_string(
-        conn_str=conn_str, container_name=container_name, blob_name=file_path
-    ) as blob:
-        blob_size = (await blob.get_blob_properties()).size
+    def __init__(self, max_size: int, max_entry_size: int) -> None:
+        """
+        :param max_size: Total size of the cached contents, in bytes
+        :type max_size: int
+        :param max_entry_size: Largest content that is cached, in bytes
+        :type max_entry_size: int
+        """
 
-    return blob_size
+        self.max_size = max_size
+        self.max_entry_size = min(max_entry_size, max_size)
+        self.size = 0
+        self.__entries: "OrderedDict[Tuple[str, str], Tuple[str, bytes]]" = OrderedDict()
 
+    def __len__(self) -> int:
+        return len(self.__entries)
 
-async def upload_blob_async(
-    conn_str: str, container_name: str, file_name: str, file_path: Optional[str] = None
-) -> None:
-    """Uploads a blob to the storage account
-    :param conn_str: Connection String to the Storage Account hosting the Blob
-    :type conn_str: str
-    :param container_name: Name of the Container where the blob is hosted
-        in the Azure Storage Account
-    :type container_name: str
-    :param file_path: Relative path to the blob with ref. to the container
-    :type file_path: str
-    :param file_name: Name of the blob in storage account
-    :type file_name: str
-    :returns: None
-    :rtype: None
+    def get(self, container_name: str, blob_name: str) -> Optional[Tuple[str, bytes]]:
+        """Gets the cached content of a blob, and marks it as recently used
+        :param container_name: Name of the Container where the blob is hosted
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        :returns: ETag and content of the blob, None if it isn't cached
+        :rtype: Optional[Tuple[str, bytes]]
+        """
+
+        key = (container_name, blob_name)
+        entry = self.__entries.get(key)
+
+        if entry is not None:
+            self.__entries.move_to_end(key)
+
+        return entry
+
+    def put(self, container_name: str, blob_name: str, etag: str, data: bytes) -> None:
+        """Caches the content of a blob, evicting the least recently used blobs
+        to make room for it. Contents larger than max_entry_size are not cached
+        :param container_name: Name of the Container where the blob is hosted
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        :param etag: ETag of the downloaded content
+        :type etag: str
+        :param data: Content of the blob
+        :type data: bytes
+        """
+
+        self.discard(container_name, blob_name)
+
+        if len(data) > self.max_entry_size:
+            return
+
+        self.__entries[(container_name, blob_name)] = (etag, data)
+        self.size += len(data)
+
+        while self.size > self.max_size:
+            _, (_, evicted) = self.__entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def discard(self, container_name: str, blob_name: str) -> None:
+        """Removes a blob from the cache, if it's cached
+        :param container_name: Name of the Container where the blob is hosted
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        """
+
+        entry = self.__entries.pop((container_name, blob_name), None)
+
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class BlobService:
+    """Long-lived access to the blobs of a Storage Account. The service owns a single
+    event loop, running on a background thread, and one ContainerClient per container
+    so that the HTTP connection pool is reused across calls. Coroutines are executed
+    on the loop with `run` and may be issued from any thread. Small downloaded blobs
+    are kept in a BlobCache and only transferred again when their ETag changed.
     """
-    blob = BlobClient.from_connection_string(
-        conn_str=conn_str,
-        container_name=container_name,
-        blob_name=f"{file_path}/{file_name}" if file_path is not None else file_name,
-    )
-
-    async with blob:
-        # [START upload_blob_to_container]
+
+    MAX_CONCURRENT_OPERATIONS = 8  # default cap on operations in flight for `gather`
+
+    CHUNK_SIZE = 4 * 1024 * 1024  # size of each ranged GET when downloading, in bytes
+    MAX_CONCURRENCY = 4  # parallel ranged GETs per download, parallel blocks per upload
+    BLOCK_SIZE = 4 * 1024 * 1024  # size of each staged block when uploading, in bytes
+
+    def __init__(
+        self,
+        conn_str: str,
+        chunk_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        block_size: Optional[int] = None,
+        cache_size: Optional[int] = None,
+    ) -> None:
+        """
+        :param conn_str: Connection String to the Storage Account hosting the Blobs
+        :type conn_str: str
+        :param chunk_size: Size of each ranged GET when downloading, defaults to
+            CHUNK_SIZE. Peak memory per download is about chunk_size * max_concurrency
+        :type chunk_size: int
+        :param max_concurrency: Number of parallel ranged GETs per download and of
+            parallel staged blocks per upload, defaults to MAX_CONCURRENCY
+        :type max_concurrency: int
+        :param block_size: Size of each staged block when uploading, defaults to
+            BLOCK_SIZE. Data up to this size is uploaded with a single PUT
+        :type block_size: int
+        :param cache_size: Memory used by the cache of downloaded blobs, in bytes,
+            defaults to BLOB_CACHE_SIZE. 0 disables the cache
+        :type cache_size: int
+        """
+
+        self.__conn_str = conn_str
+        self.__chunk_size = chunk_size or self.CHUNK_SIZE
+        self.__max_concurrency = max_concurrency or self.MAX_CONCURRENCY
+        self.__block_size = block_size or self.BLOCK_SIZE
+        self.__containers: dict[str, ContainerClient] = {}
+
+        cache_size = BLOB_CACHE_SIZE if cache_size is None else cache_size
+        self.cache = (
+            BlobCache(cache_size, BLOB_CACHE_MAX_ENTRY_SIZE) if cache_size > 0 else None
+        )
+
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+        self.__thread.start()
+
+    def __enter__(self) -> "BlobService":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Runs a coroutine on the service's event loop and waits for its result
+        :param coro: Coroutine to run, typically one of the service's blob operations
+        :type coro: Coroutine
+        :returns: Result of the coroutine
+        :rtype: Any
+        """
+
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop).result()
+
+    def gather(
+        self, *coros: Coroutine[Any, Any, Any], limit: Optional[int] = None
+    ) -> list[Any]:
+        """Runs independent coroutines concurrently on the service's event loop and
+        waits for all of them. At most `limit` of them are in flight at any time
+        :param coros: Coroutines to run, typically the service's blob operations
+        :type coros: Coroutine
+        :param limit: Maximum number of coroutines in flight, defaults to
+            MAX_CONCURRENT_OPERATIONS
+        :type limit: int
+        :returns: Results of the coroutines, in the order they were passed in
+        :rtype: list[Any]
+        """
+
+        async def gather_bounded() -> list[Any]:
+            semaphore = asyncio.Semaphore(limit or self.MAX_CONCURRENT_OPERATIONS)
+
+            async def run_bounded(coro: Coroutine[Any, Any, Any]) -> Any:
+                async with semaphore:
+                    return await coro
+
+            return list(await asyncio.gather(*(run_bounded(coro) for coro in coros)))
+
+        return self.run(gather_bounded())
+
+    def close(self) -> None:
+        """Closes the pooled clients and stops the event loop
+        :returns: None
+        :rtype: None
+        """
+
+        if self.__loop.is_closed():
+            return
+
+        async def close_clients() -> None:
+            for container in self.__containers.values():
+                await container.close()
+
+            self.__containers.clear()
+
+        self.run(close_clients())
+
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+
+    def __get_container_client(self, container_name: str) -> ContainerClient:
+        """Gets the pooled client of a container, creating it on first use.
+        Must only be called from the service's event loop
+        :param container_name: Name of the Container in the Azure Storage Account
+        :type container_name: str
+        :returns: Client for the container
+        :rtype: ContainerClient
+        """
+
+        container = self.__containers.get(container_name)
+
+        if container is None:
+            # the first GET of a download is capped to a chunk as well so that no
+            # single response is buffered whole in memory
+            container = ContainerClient.from_connection_string(
+                conn_str=self.__conn_str,
+                container_name=container_name,
+                max_single_get_size=self.__chunk_size,
+                max_chunk_get_size=self.__chunk_size,
+                max_single_put_size=self.__block_size,
+                max_block_size=self.__block_size,
+            )
+            self.__containers[container_name] = container
+
+        return container
+
+    def __get_blob_client(self, container_name: str, blob_name: str) -> BlobClient:
+        """Gets a client for a blob backed by the pooled client of its container.
+        Must only be called from the service's event loop
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        :returns: Client for the blob
+        :rtype: BlobClient
+        """
+
+        return self.__get_container_client(container_name).get_blob_client(blob_name)
+
+    async def list_blobs_async(
+        self, container_name: str, prefix: Optional[str] = None
+    ) -> dict[str, Optional[str]]:
+        """Lists the blobs of a container, page by page
+        :param container_name: Name of the Container in the Azure Storage Account
+        :type container_name: str
+        :param prefix: Only list the blobs whose name starts with this prefix,
+            e.g. v002/wa/2015/
+        :type prefix: str
+        :returns: ETag of every blob, keyed by blob name
+        :rtype: dict[str, Optional[str]]
+        """
+
+        container = self.__get_container_client(container_name)
+
+        return {
+            blob.name: blob.etag
+            async for blob in container.list_blobs(
+                name_starts_with=prefix, results_per_page=LIST_PAGE_SIZE
+            )
+        }
+
+    async def check_if_blob_exists(self, container_name: str, blob_name: str) -> bool:
+        """Checks if a blob exists in the storage account
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        :returns: True if the blob exists; otherwise false
+        :rtype: bool
+        """
+
+        blob = self.__get_blob_client(container_name, blob_name)
+
+        return await blob.exists()
+
+    async def get_blob_size(self, container_name: str, file_path: str) -> int:
+        """Get the size of the blob in Storage Account (in bytes)
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param file_path: Relative path to the blob with ref. to the container
+        :type file_path: str
+        :returns: Size of the blob in bytes
+        :rtype: int
+        """
+
+        blob = self.__get_blob_client(container_name, file_path)
+
+        return (await blob.get_blob_properties()).size
+
+    async def upload_data_async(
+        self,
+        container_name: str,
+        blob_name: str,
+        data: Union[bytes, str, IO[bytes]],
+        overwrite: bool = False,
+        max_concurrency: Optional[int] = None,
+        content_type: Optional[str] = None,
+    ) -> None:
+        """Uploads in-memory data or a readable stream as a blob. Data larger than
+        the block size is staged as blocks, several of them in parallel
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        :param data: Content of the blob, as bytes, str or a file-like object
+        :type data: Union[bytes, str, IO[bytes]]
+        :param overwrite: Replace the blob if it already exists, otherwise the
+            upload fails for existing blobs
+        :type overwrite: bool
+        :param max_concurrency: Number of blocks uploaded in parallel, defaults to
+            the value the service was created with
+        :type max_concurrency: int
+        :param content_type: Optional Content-Type to store with the blob
+        :type content_type: str
+        :returns: None
+        :rtype: None
+        """
+
+        from azure.storage.blob import ContentSettings
+
+        blob = self.__get_blob_client(container_name, blob_name)
+
+        await blob.upload_blob(
+            data=data,
+            overwrite=overwrite,
+            max_concurrency=max_concurrency or self.__max_concurrency,
+            content_settings=(
+                ContentSettings(content_type=content_type) if content_type is not None else None
+            ),
+        )
+
+    async def upload_blob_async(
+        self,
+        container_name: str,
+        file_name: str,
+        file_path: Optional[str] = None,
+        overwrite: bool = False,
+    ) -> None:
+        """Uploads a local file to the storage account
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param file_path: Relative path to the blob with ref. to the container
+        :type file_path: str
+        :param file_name: Name of the blob in storage account
+        :type file_name: str
+        :param overwrite: Replace the blob if it already exists
+        :type overwrite: bool
+        :returns: None
+        :rtype: None
+        """
+
         with open(file_name, "rb") as blob_data:
-            await blob.upload_blob(data=blob_data)
+            await self.upload_data_async(
+                container_name=container_name,
+                blob_name=f"{file_path}/{file_name}" if file_path is not None else file_name,
+                data=blob_data,
+                overwrite=overwrite,
+            )
 
+    async def __download(
+        self,
+        container_name: str,
+        blob_name: str,
+        max_concurrency: Optional[int] = None,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+    ) -> Union[bytes, StorageStreamDownloader, None]:
+        """Starts the download of a blob, or of a range of it, with a single GET.
+        When the whole blob is cached the download is conditional (If-None-Match)
+        and the cached content is returned as long as the blob didn't change
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        :param max_concurrency: Number of parallel ranged GETs, defaults to the
+            value the service was created with
+        :type max_concurrency: int
+        :param offset: Start of the range to download, in bytes
+        :type offset: int
+        :param length: Number of bytes to download, requires offset
+        :type length: int
+        :returns: Content of the blob from the cache, the download stream, or None
+            when the blob doesn't exist
+        :rtype: Union[bytes, StorageStreamDownloader, None]
+        """
 
-# Data is being downloaded locally and will need to be cleaned up
-# by the calling module.
-async def download_blob_async(
-    conn_str: str, container_name: str, file_path: str, destination_path: str
-) -> str:
-    """Download blob from azure storage account. Will not overwrite
-    if the file already exists
-    :param conn_str: Connection String to the Storage Account hosting the Blob
-    :type conn_str: str
-    :param container_name: Name of the Container where the blob is hosted
-        in the Azure Storage Account
-    :type container_name: str
-    :param file_path: Relative path to the blob with ref. to the container
-    :type file_path: str
-    :param destination_path: Absolute location to the local folder where
-        the blob needs to be downloaded to
-    :type destination_path: str
-    :returns: Path to the local downloaded file
-    :rtype: str
-    """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+        blob_client = self.__get_blob_client(container_name, blob_name)
+        cached = (
+            self.cache.get(container_name, blob_name)
+            if self.cache is not None and offset is None and length is None
+            else None
+        )
+        conditions: dict[str, Any] = (
+            {"etag": cached[0], "match_condition": MatchConditions.IfModified}
+            if cached is not None
+            else {}
+        )
+
+        try:
+            return await blob_client.download_blob(
+                offset=offset,
+                length=length,
+                max_concurrency=max_concurrency or self.__max_concurrency,
+                **conditions,
+            )
+
+        except ResourceNotFoundError:
+            if self.cache is not None:
+                self.cache.discard(container_name, blob_name)
+
+            return None
+
+        except HttpResponseError as e:
+            # 304 Not Modified, raised as ResourceNotModifiedError or as a bare
+            # HttpResponseError depending on the version of the SDK
+            if cached is None or e.status_code != 304:
+                raise e
+
+            return cached[1]
+
+    async def download_data_async(
+        self,
+        container_name: str,
+        blob_name: str,
+        max_concurrency: Optional[int] = None,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+    ) -> Optional[bytes]:
+        """Download a blob, or a range of it, into memory with a single request.
+        Meant for small blobs such as STAC JSON or metadata documents, which are
+        served from the cache while they don't change. Use download_blob_async
+        for large blobs
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param blob_name: Relative path to the blob with ref. to the container
+        :type blob_name: str
+        :param max_concurrency: Number of parallel ranged GETs, defaults to the
+            value the service was created with
+        :type max_concurrency: int
+        :param offset: Start of the range to download, in bytes. Defaults to the
+            whole blob
+        :type offset: int
+        :param length: Number of bytes to download, requires offset. Defaults to
+            the rest of the blob
+        :type length: int
+        :returns: Content of the blob, None if the blob doesn't exist
+        :rtype: Optional[bytes]
+        """
 
-    blob_name = os.path.basename(file_path)
+        stream = await self.__download(
+            container_name, blob_name, max_concurrency, offset, length
+        )
+
+        if stream is None or isinstance(stream, bytes):
+            return stream
+
+        data = await stream.readall()
+
+        if self.cache is not None and offset is None and length is None:
+            self.cache.put(container_name, blob_name, stream.properties.etag, data)
+
+        return data
+
+    # Data is being downloaded locally and will need to be cleaned up
+    # by the calling module.
+    async def download_blob_async(
+        self,
+        container_name: str,
+        file_path: str,
+        destination_path: str,
+        max_concurrency: Optional[int] = None,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+    ) -> Optional[str]:
+        """Download blob, or a range of it, from azure storage account with a single
+        request. The blob is streamed to disk chunk by chunk, so memory use does
+        not depend on the size of the blob
+        :param container_name: Name of the Container where the blob is hosted
+            in the Azure Storage Account
+        :type container_name: str
+        :param file_path: Relative path to the blob with ref. to the container
+        :type file_path: str
+        :param destination_path: Absolute location to the local folder where
+            the blob needs to be downloaded to
+        :type destination_path: str
+        :param max_concurrency: Number of parallel ranged GETs, defaults to the
+            value the service was created with
+        :type max_concurrency: int
+        :param offset: Start of the range to download, in bytes. Defaults to the
+            whole blob
+        :type offset: int
+        :param length: Number of bytes to download, requires offset. Defaults to
+            the rest of the blob
+        :type length: int
+        :returns: Path to the local downloaded file, None if the blob doesn't exist
+        :rtype: Optional[str]
+        """
+
+        # get the full path for the destination where the file will be
+        # downloaded including the leaf file name
+        download_file_path = os.path.join(destination_path, os.path.basename(file_path))
+        whole_blob = offset is None and length is None
 
-    try:
-        async with BlobClient.from_connection_string(
-            conn_str=conn_str, container_name=container_name, blob_name=blob_name
-        ) as blob_client:
-            _, file_name = os.path.split(blob_client.blob_name)
+        stream = await self.__download(
+            container_name, file_path, max_concurrency, offset, length
+        )
 
-            # get the full path for the destination where the file will be
-            # downloaded including the leaf file name
-            download_file_path = os.path.join(destination_path, file_name)
+        if stream is None:
+            return None
 
-            does_blob_exist = await blob_client.exists()
+        try:
+            with open(download_file_path, "wb") as fh:
+                if isinstance(stream, bytes):
+                    fh.write(stream)
 
-            # check for blob existence
-            if does_blob_exist:
-                with open(download_file_path, "wb") as fh:
-                    stream = await blob_client.download_blob()
+                elif (
+                    self.cache is not None
+                    and whole_blob
+                    and stream.size <= self.cache.max_entry_size
+                ):
                     data = await stream.readall()
                     fh.write(data)
+                    self.cache.put(container_name, file_path, stream.properties.etag, data)
+
+                else:
+                    await stream.readinto(fh)
 
-            return download_file_path
+        except Exception as e:
+            # do not leave a partially written file behind
+            if os.path.exists(download_file_path):
+                os.remove(download_file_path)
 
-    except Exception as e:
-        raise e
+            raise e
 
+        return download_file_path
 
-def generate_sas_token(conn_str: str) -> str:
-    """Generate SAS Token for reading objects from Storage Account. Future use will be
-    extended to include settings to let users specific resource types and permissions
+
+def generate_sas_token(
+    conn_str: str,
+    permission: str = "r",
+    resource_types: str = "o",
+    lifetime: Optional[timedelta] = None,
+    refresh_margin: Optional[timedelta] = None,
+) -> str:
+    """Generate SAS Token for reading objects from Storage Account. Tokens are cached
+    for the whole process per account, permissions and resource types, and reused
+    until they are within `refresh_margin` of their expiry
     :param conn_str: Connection string to the Storage Account
     :type conn_str: str
+    :param permission: Account SAS permissions, e.g. "r" or "rl"
+    :type permission: str
+    :param resource_types: Account SAS resource types, e.g. "o" or "co"
+    :type resource_types: str
+    :param lifetime: How long a new token is valid for, defaults to SAS_TOKEN_LIFETIME
+    :type lifetime: timedelta
+    :param refresh_margin: How long before its expiry a cached token is replaced,
+        defaults to SAS_TOKEN_REFRESH_MARGIN
+    :type refresh_margin: timedelta
     :returns: SAS token as string
     :rtype: str
     """
 
-    from datetime import datetime, timedelta
+    from azure.storage.blob import AccountSasPermissions, ResourceTypes, generate_account_sas
 
-    from azure.storage.blob import (
-        AccountSasPermissions,
-        BlobServiceClient,
-        ResourceTypes,
-        generate_account_sas,
-    )
+    # connection string is a list of key=value pairs separated by semicolons
+    settings = dict(part.split("=", 1) for part in conn_str.split(";") if "=" in part)
+    account_name = settings["AccountName"]
 
-    blob_service_client = BlobServiceClient.from_connection_string(conn_str=conn_str)
+    key = (account_name, permission, resource_types)
 
-    expiration = None
+    with _sas_tokens_lock:
+        cached = _sas_tokens.get(key)
 
-    if expiration is None or datetime.utcnow() >= expiration:
-        # set expiration time for the SAS token to be 1 days
-        expiration = datetime.utcnow() + timedelta(days=1)
+        if cached is not None:
+            sas_token, expiration = cached
+
+            if datetime.utcnow() < expiration - (refresh_margin or SAS_TOKEN_REFRESH_MARGIN):
+                return sas_token
+
+        expiration = datetime.utcnow() + (lifetime or SAS_TOKEN_LIFETIME)
 
         sas_token = generate_account_sas(
-            blob_service_client.account_name,
-            account_key=blob_service_client.credential.account_key,
-            resource_types=ResourceTypes(object=True),
-            permission=AccountSasPermissions(read=True),
+            account_name,
+            account_key=settings["AccountKey"],
+            resource_types=ResourceTypes.from_string(resource_types),
+            permission=AccountSasPermissions.from_string(permission),
             expiry=expiration,
         )
 
+        _sas_tokens[key] = (sas_token, expiration)
+
         return sas_token
+
+
+def read_blob_inventory(
+    inventory_path: str, container_name: Optional[str] = None, prefix: Optional[str] = None
+) -> dict[str, Optional[str]]:
+    """Reads the blobs listed by an Azure Blob Inventory report, as an alternative
+    to listing very large containers. CSV reports are read with the standard library,
+    Parquet reports require pyarrow
+    :param inventory_path: Local path to the CSV or Parquet inventory report
+    :type inventory_path: str
+    :param container_name: Optional name of the Container the report covers, it's
+        removed from the start of the blob names when the report includes it
+    :type container_name: str
+    :param prefix: Only keep the blobs whose name starts with this prefix
+    :type prefix: str
+    :returns: ETag of every blob, keyed by blob name. ETags are None when the
+        report doesn't include them
+    :rtype: dict[str, Optional[str]]
+    """
+
+    rows: Iterable[tuple[str, Optional[str]]]
+
+    if inventory_path.lower().endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("pyarrow is required to read Parquet inventory reports") from e
+
+        table = pq.read_table(inventory_path)
+        columns = {name.lower(): name for name in table.column_names}
+        names = table.column(columns["name"]).to_pylist()
+        etags = (
+            table.column(columns["etag"]).to_pylist()
+            if "etag" in columns
+            else [None] * len(names)
+        )
+        rows = zip(names, etags)
+
+    else:
+        import csv
+
+        with open(inventory_path, newline="") as fh:
+            reader = csv.reader(fh)
+            header = [column.lower() for column in next(reader)]
+            name_index = header.index("name")
+            etag_index = header.index("etag") if "etag" in header else None
+            rows = [
+                (row[name_index], row[etag_index] if etag_index is not None else None)
+                for row in reader
+                if row
+            ]
+
+    container_prefix = f"{container_name}/" if container_name is not None else None
+    blobs: dict[str, Optional[str]] = {}
+
+    for name, etag in rows:
+        if container_prefix is not None:
+            name = name.removeprefix(container_prefix)
+
+        if prefix is None or name.startswith(prefix):
+            blobs[name] = etag
+
+    return blobs
@@ -0,0 +1,129 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import sqlite3
+import threading
+import time
+from types import TracebackType
+from typing import Iterable, Optional, Tuple, Type
+
+
+class IdempotencyIndex:
+    """Persistent record of the work already done, keyed by the name of the source
+    blob and its ETag. Backed by a local SQLite database so that lookups take
+    microseconds and survive restarts of the processor. Processors consult it
+    before the heavy work and mark the blob once the work succeeded, a blob is
+    only considered done for the ETag it had at that time so that overwritten
+    blobs are processed again. Safe to use from several threads
+    """
+
+    def __init__(self, path: str, namespace: str) -> None:
+        """
+        :param path: Path to the SQLite database, created if needed. Several
+            processors may share the same database
+        :type path: str
+        :param namespace: Name that keeps the records of a processor apart from
+            those of the other processors, e.g. the processor's class name
+        :type namespace: str
+        """
+
+        self.__namespace = namespace
+        self.__lock = threading.Lock()
+
+        self.__conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " etag TEXT NOT NULL,"
+            " processed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+
+    def __enter__(self) -> "IdempotencyIndex":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def is_done(self, key: str, etag: Optional[str]) -> bool:
+        """Checks if a blob was already processed in its current version
+        :param key: Name of the source blob, or any other stable id of the work
+        :type key: str
+        :param etag: Current ETag of the source blob. Blobs without an ETag are
+            never considered done
+        :type etag: str
+        :returns: True if the blob was processed with the same ETag
+        :rtype: bool
+        """
+
+        if etag is None:
+            return False
+
+        with self.__lock:
+            row = self.__conn.execute(
+                "SELECT etag FROM processed WHERE namespace = ? AND key = ?",
+                (self.__namespace, key),
+            ).fetchone()
+
+        return row is not None and row[0] == etag
+
+    def mark_done(self, key: str, etag: Optional[str]) -> None:
+        """Records that a blob was processed
+        :param key: Name of the source blob, or any other stable id of the work
+        :type key: str
+        :param etag: ETag of the source blob that was processed, nothing is recorded
+            without it
+        :type etag: str
+        :returns: None
+        :rtype: None
+        """
+
+        self.mark_many([(key, etag)])
+
+    def mark_many(self, entries: Iterable[Tuple[str, Optional[str]]]) -> None:
+        """Records that several blobs were processed, in a single transaction
+        :param entries: Key and ETag of every blob, see mark_done
+        :type entries: Iterable[Tuple[str, Optional[str]]]
+        :returns: None
+        :rtype: None
+        """
+
+        now = time.time()
+        rows = [(self.__namespace, key, etag, now) for key, etag in entries if etag is not None]
+
+        if not rows:
+            return
+
+        with self.__lock:
+            self.__conn.execute("BEGIN")
+            try:
+                self.__conn.executemany(
+                    "INSERT OR REPLACE INTO processed (namespace, key, etag, processed_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+
+            except Exception as e:
+                self.__conn.execute("ROLLBACK")
+                raise e
+
+            self.__conn.execute("COMMIT")
+
+    def close(self) -> None:
+        """Closes the database
+        :returns: None
+        :rtype: None
+        """
+
+        with self.__lock:
+            self.__conn.close()
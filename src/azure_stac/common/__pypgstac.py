@@ -3,21 +3,292 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-import subprocess
+import json
+import os
+import threading
+import time
+from types import TracebackType
+from typing import Any, Iterable, Iterator, Optional, Type
 
 
-def load_item(file_path: str) -> None:
-    """Load stac item to PostgreSQL
-    :param file_path: Absolute path to the JSON file that contains the STAC Item
-    :type file_path: str
-    :returns: None
-    :rtype: None
+class ItemLoader:
+    """Loads STAC items to PostgreSQL in-process with pypgstac's Loader. Items are
+    buffered and written in batches over a pooled connection, a batch is flushed
+    once it holds `batch_size` items or `flush_interval` seconds have passed since
+    the previous flush. Call `flush` to write the buffered items right away.
     """
 
-    try:
-        cmd = f"pypgstac load items {file_path} --method insert".split()
+    BATCH_SIZE = 500  # items buffered before they are written
+    FLUSH_INTERVAL = 5.0  # seconds buffered items may wait before they are written
 
-        subprocess.check_call(cmd)
+    def __init__(
+        self,
+        dsn: str = "",
+        method: str = "insert",
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+    ) -> None:
+        """
+        :param dsn: PostgreSQL connection string, the PG* environment variables
+            are used when empty
+        :type dsn: str
+        :param method: How existing items are handled, one of pypgstac's load
+            methods such as insert, upsert or ignore
+        :type method: str
+        :param batch_size: Items buffered before they are written, defaults to
+            BATCH_SIZE
+        :type batch_size: int
+        :param flush_interval: Seconds buffered items may wait before they are
+            written, defaults to FLUSH_INTERVAL
+        :type flush_interval: float
+        """
 
-    except Exception as e:
-        raise e
+        from pypgstac.db import PgstacDB
+        from pypgstac.load import Loader, Methods
+
+        self.__method = Methods(method)
+        self.__batch_size = batch_size or self.BATCH_SIZE
+        self.__flush_interval = flush_interval or self.FLUSH_INTERVAL
+
+        self.__db = PgstacDB(dsn=dsn)
+        self.__loader = Loader(db=self.__db)
+
+        self.__items: list[dict[str, Any]] = []
+        self.__last_flush = time.monotonic()
+
+        # guards the buffer, the loader itself works over a single connection
+        self.__buffer_lock = threading.Lock()
+        self.__loader_lock = threading.Lock()
+
+    def __enter__(self) -> "ItemLoader":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def add(self, item: dict[str, Any]) -> None:
+        """Adds a STAC item to the buffer, flushing it when it is due
+        :param item: STAC Item as a dictionary
+        :type item: dict[str, Any]
+        :returns: None
+        :rtype: None
+        """
+
+        with self.__buffer_lock:
+            self.__items.append(item)
+
+            is_due = (
+                len(self.__items) >= self.__batch_size
+                or time.monotonic() - self.__last_flush >= self.__flush_interval
+            )
+
+        if is_due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes all the buffered items to PostgreSQL
+        :returns: None
+        :rtype: None
+        """
+
+        with self.__buffer_lock:
+            items, self.__items = self.__items, []
+            self.__last_flush = time.monotonic()
+
+        if not items:
+            return
+
+        with self.__loader_lock:
+            self.__loader.load_items(iter(items), insert_mode=self.__method)
+
+    def close(self) -> None:
+        """Flushes the buffered items and releases the database connection
+        :returns: None
+        :rtype: None
+        """
+
+        try:
+            self.flush()
+        finally:
+            self.__db.close()
+
+
+class BulkItemLoader:
+    """Loads large numbers of STAC items to PostgreSQL for backfills. Items are
+    streamed with a binary COPY into one of pgstac's staging tables, whose statement
+    trigger creates the missing partitions and merges the rows into the items table
+    in one pass. Every `batch_size` items are copied and merged in their own
+    transaction. Has the same add/flush/close interface as ItemLoader.
+    """
+
+    BATCH_SIZE = 10000  # items copied and merged per transaction
+
+    # pgstac staging table used for each load method
+    STAGING_TABLES = {
+        "insert": "items_staging",
+        "ignore": "items_staging_ignore",
+        "upsert": "items_staging_upsert",
+    }
+
+    def __init__(self, dsn: str = "", method: str = "insert", batch_size: Optional[int] = None):
+        """
+        :param dsn: PostgreSQL connection string, the PG* environment variables
+            are used when empty
+        :type dsn: str
+        :param method: How existing items are handled: insert, ignore or upsert
+        :type method: str
+        :param batch_size: Items copied and merged per transaction, defaults to
+            BATCH_SIZE
+        :type batch_size: int
+        """
+
+        import psycopg
+
+        if method not in self.STAGING_TABLES:
+            raise ValueError(f"Invalid load method: {method}")
+
+        self.__table = self.STAGING_TABLES[method]
+        self.__batch_size = batch_size or self.BATCH_SIZE
+
+        self.__conn = psycopg.connect(dsn)
+        self.__items: list[dict[str, Any]] = []
+        self.__lock = threading.Lock()
+
+    def __enter__(self) -> "BulkItemLoader":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def __copy(self, items: Iterable[dict[str, Any]]) -> int:
+        """Copies items into the staging table and commits, which merges them
+        :param items: STAC Items as dictionaries
+        :type items: Iterable[dict[str, Any]]
+        :returns: Number of items copied
+        :rtype: int
+        """
+
+        from psycopg import sql
+        from psycopg.types.json import Jsonb
+
+        count = 0
+
+        statement = sql.SQL("COPY {} (content) FROM STDIN (FORMAT BINARY)").format(
+            sql.Identifier("pgstac", self.__table)
+        )
+
+        with self.__conn.transaction():
+            with self.__conn.cursor() as cursor:
+                with cursor.copy(statement) as copy:
+                    copy.set_types(["jsonb"])
+
+                    for item in items:
+                        copy.write_row((Jsonb(item),))
+                        count += 1
+
+        return count
+
+    def load(self, items: Iterable[dict[str, Any]]) -> int:
+        """Streams items to PostgreSQL, `batch_size` items per transaction
+        :param items: STAC Items as dictionaries, consumed lazily
+        :type items: Iterable[dict[str, Any]]
+        :returns: Number of items loaded
+        :rtype: int
+        """
+
+        import itertools
+
+        count = 0
+        iterator = iter(items)
+
+        with self.__lock:
+            while True:
+                loaded = self.__copy(itertools.islice(iterator, self.__batch_size))
+
+                if loaded == 0:
+                    return count
+
+                count += loaded
+
+    def add(self, item: dict[str, Any]) -> None:
+        """Adds a STAC item to the buffer, flushing it once it holds batch_size items
+        :param item: STAC Item as a dictionary
+        :type item: dict[str, Any]
+        :returns: None
+        :rtype: None
+        """
+
+        with self.__lock:
+            self.__items.append(item)
+            is_due = len(self.__items) >= self.__batch_size
+
+        if is_due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes all the buffered items to PostgreSQL
+        :returns: None
+        :rtype: None
+        """
+
+        with self.__lock:
+            items, self.__items = self.__items, []
+
+            if items:
+                self.__copy(items)
+
+    def close(self) -> None:
+        """Flushes the buffered items and closes the database connection
+        :returns: None
+        :rtype: None
+        """
+
+        try:
+            self.flush()
+        finally:
+            self.__conn.close()
+
+
+def read_items(path: str) -> Iterator[dict[str, Any]]:
+    """Reads STAC items from a JSON or NDJSON file, or from all such files in a
+    folder. JSON files may hold a single item, a list of items or a FeatureCollection
+    :param path: Path to a file or to a folder of files
+    :type path: str
+    :returns: STAC Items as dictionaries, read lazily
+    :rtype: Iterator[dict[str, Any]]
+    """
+
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for file_name in sorted(files):
+                if file_name.endswith((".json", ".ndjson")):
+                    yield from read_items(os.path.join(root, file_name))
+
+        return
+
+    with open(path, "r") as f:
+        if path.endswith(".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+            return
+
+        data = json.load(f)
+
+    if isinstance(data, dict) and data.get("type") == "FeatureCollection":
+        yield from data["features"]
+    elif isinstance(data, list):
+        yield from data
+    else:
+        yield data
@@ -3,44 +3,38 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-import json
 import os
-from pathlib import Path
+from typing import Optional
 
 
-def getenv(variable_name: str) -> str:
+def getenv(variable_name: str, default_value: Optional[str] = None) -> str:
     """Gets an environment variable or raises an exception if it is not set
+    and no default value is provided
     :param variable_name: Name of the environment variable
     :type variable_name: str
+    :param default_value: Value to fall back to when the variable is not set
+    :type default_value: str
     :returns: Environment variable value
     :rtype: str
     """
 
-    value = os.getenv(variable_name)
+    value = os.getenv(variable_name, default_value)
     if value is None:
         raise ValueError(f"{variable_name} is not set")
 
     return value
 
 
-def convert_json_to_ndjson(file_path: str) -> str:
-    """Converts json to ndjson
-    :param file_path: Absolute path to the JSON file to be converted to NDJSON
-    :type file_path: str
-    :returns: None
+def get_blob_name_from_url(url: str) -> str:
+    """Gets the name of a blob, relative to its container, from the blob's URL
+    :param url: Full URL of the blob, e.g.
+        https://account.blob.core.windows.net/container/path/to/blob.ext
+    :type url: str
+    :returns: Name of the blob, e.g. path/to/blob.ext
     :rtype: str
     """
 
-    ndjson_name = Path(file_path).stem + ".ndjson"
+    from urllib.parse import unquote, urlparse
 
-    try:
-        with open(file_path, "r") as file:
-            data = json.load(file)
-
-            with open(ndjson_name, "w") as outfile:
-                json.dump(data, outfile, separators=(",", ":"))
-
-    except Exception as e:
-        raise e
-
-    return ndjson_name
+    # path is /container/blob-name
+    return unquote(urlparse(url).path.split("/", 2)[2])
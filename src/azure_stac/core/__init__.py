@@ -15,6 +15,7 @@ from knack.cli import CLI
 from knack.commands import CLICommandsLoader, CommandGroup
 
 from azure_stac.commands.processor import processor_cf
+from azure_stac.core.profiling import PROFILE_MODES
 
 EXCLUDED_PARAMS = ["self", "kwargs", "client"]
 
@@ -69,6 +70,8 @@ class StacCommandsLoader(CLICommandsLoader):
         ) as group:
             group.command("run", "run_processor")
             group.command("list", "list_processors")
+            group.command("backfill", "backfill_processor")
+            group.command("bulk-load", "bulk_load_items")
 
         return OrderedDict(self.command_table)
 
@@ -77,6 +80,84 @@ class StacCommandsLoader(CLICommandsLoader):
             ac.argument(
                 "name", arg_type=CLIArgumentType(type=str, help="Name of the processor to run")
             )
+            ac.argument(
+                "profile",
+                arg_type=CLIArgumentType(
+                    type=str,
+                    choices=list(PROFILE_MODES),
+                    help="Run the processor under cProfile, processing the messages one "
+                    "at a time on the main thread, or under a sampling profiler of all "
+                    "the threads",
+                ),
+            )
+            ac.argument(
+                "profile_output",
+                arg_type=CLIArgumentType(
+                    type=str,
+                    help="Path of the profile, a pstats file for cprofile and folded "
+                    "stacks (flame graphs) for sampling. Defaults to {name}.pstats or "
+                    "{name}.folded",
+                ),
+            )
+            ac.argument(
+                "max_messages",
+                arg_type=CLIArgumentType(
+                    type=int, help="Stop once this many messages were received"
+                ),
+            )
+            ac.argument(
+                "max_run_time",
+                arg_type=CLIArgumentType(
+                    type=float, help="Stop receiving messages after this many seconds"
+                ),
+            )
+
+        with ArgumentsContext(self, "processor backfill") as ac:
+            ac.argument(
+                "name", arg_type=CLIArgumentType(type=str, help="Name of the processor to run")
+            )
+            ac.argument(
+                "prefix",
+                arg_type=CLIArgumentType(
+                    type=str,
+                    help="Only process the blobs under this prefix, e.g. v002/wa/2015/",
+                ),
+            )
+            ac.argument(
+                "inventory",
+                arg_type=CLIArgumentType(
+                    type=str,
+                    help="CSV or Parquet Blob Inventory report to read instead of listing",
+                ),
+            )
+            ac.argument(
+                "concurrency",
+                arg_type=CLIArgumentType(
+                    type=int, help="Number of blobs processed in parallel"
+                ),
+            )
+
+        with ArgumentsContext(self, "processor bulk-load") as ac:
+            ac.argument(
+                "path",
+                arg_type=CLIArgumentType(
+                    type=str, help="JSON/NDJSON file, or folder of files, with STAC items"
+                ),
+            )
+            ac.argument(
+                "method",
+                arg_type=CLIArgumentType(
+                    type=str,
+                    choices=["insert", "ignore", "upsert"],
+                    help="How items that already exist are handled",
+                ),
+            )
+            ac.argument(
+                "batch_size",
+                arg_type=CLIArgumentType(
+                    type=int, help="Number of items copied and merged per transaction"
+                ),
+            )
 
         super().load_arguments(command)
 
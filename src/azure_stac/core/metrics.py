@@ -3,39 +3,197 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+import functools
+import os
+import threading
+import time
 from abc import ABCMeta, abstractmethod
-from typing import Any, Callable, Tuple
+from typing import Any, Callable, Iterable, NamedTuple, Optional, Sequence, Tuple
 
+from knack.log import get_logger
+
+from azure_stac.common.__utilities import getenv
+from azure_stac.core.timing import StageRecord, StageTimings, timings
+
+logger = get_logger(__name__)
+
+# seconds between two exports of the aggregated metrics
+METRICS_FLUSH_INTERVAL = float(getenv("METRICS_FLUSH_INTERVAL", "15"))
+
+# optional path of a JSON file the stage timings are written to when a processor ends
+STAGE_TIMINGS_PATH = getenv("STAGE_TIMINGS_PATH", "")
 
-class Metrics(object, metaclass=ABCMeta):
-    CONNECTION_STRING = ""
-    MMAP = None
 
-    def _setup_open_census(self, views: Any) -> None:
+class BoundMeasures:
+    """Measures recorded together, see MetricsRegistry.bind. A measurement map is
+    built once per tag map and reused by every record with these tags"""
+
+    def __init__(self, measures: Sequence[Any], stats_recorder: Any) -> None:
         """
-        Bootstrap opencensus for sending metrics
-        :param views: List of view to register
+        :param measures: Measures to record together
+        :type measures: Sequence[Measure]
+        :param stats_recorder: Recorder the measurement maps are created from
+        :type stats_recorder: StatsRecorder
+        """
+
+        from opencensus.stats import measure as measure_module
+
+        self.__measures = [
+            (measure, isinstance(measure, measure_module.MeasureInt)) for measure in measures
+        ]
+        self.__stats_recorder = stats_recorder
+        # keyed by tag map, tag maps are compared by identity
+        self.__measurement_maps: dict[Any, Any] = {}
+        self.__lock = threading.Lock()
+
+    def record(self, values: Sequence[float], tags: Any) -> None:
+        """Records a value of every measure
+        :param values: Values, in the order of the measures
+        :type values: Sequence[float]
+        :param tags: Tags of the values, see MetricsRegistry.tag_map
+        :type tags: TagMap
+        :returns: None
+        :rtype: None
+        """
+
+        # a measurement map refuses to record for good once it was given a negative
+        # value, so they never reach the cached maps
+        if any(value < 0 for value in values):
+            logger.warning("Dropping metrics with negative values: %s", values)
+            return
+
+        with self.__lock:
+            measurement_map = self.__measurement_maps.get(tags)
+
+            if measurement_map is None:
+                measurement_map = self.__stats_recorder.new_measurement_map()
+                self.__measurement_maps[tags] = measurement_map
+
+            for (measure, is_int), value in zip(self.__measures, values):
+                if is_int:
+                    measurement_map.measure_int_put(measure, int(value))
+                else:
+                    measurement_map.measure_float_put(measure, value)
+
+            measurement_map.record(tags)
+
+
+class MetricsRegistry:
+    """Opencensus state shared by all the metrics providers of the process: a
+    single exporter to App Insights, the registered views, the name of the pod and
+    the tag maps of the combinations of tags recorded so far"""
+
+    def __init__(self, connection_string: Optional[str] = None) -> None:
+        """
+        :param connection_string: App Insights connection string, defaults to
+            AZURE_LOG_CONNECTION_STRING
+        :type connection_string: str
+        """
+
+        self.__connection_string = connection_string
+        self.__exporter: Any = None
+        self.__tag_maps: dict[Tuple[Tuple[str, Optional[str]], ...], Any] = {}
+        self.__lock = threading.Lock()
+
+        # read once, it doesn't change for the life of the pod
+        self.pod_name = os.getenv("POD_NAME")
+
+    def register_views(self, views: Iterable[Any]) -> None:
+        """Registers views, the exporter is created along with the first of them
+        :param views: Views to register
+        :type views: Iterable[View]
+        :returns: None
+        :rtype: None
         """
 
         from opencensus.ext.azure import metrics_exporter
         from opencensus.stats import stats as stats_module
 
-        stats = stats_module.stats
-
-        view_manager = stats.view_manager
+        view_manager = stats_module.stats.view_manager
 
-        exporter = metrics_exporter.new_metrics_exporter(
-            connection_string=self.CONNECTION_STRING
-        )
+        with self.__lock:
+            if self.__exporter is None:
+                self.__exporter = metrics_exporter.new_metrics_exporter(
+                    connection_string=self.__connection_string
+                    or getenv("AZURE_LOG_CONNECTION_STRING")
+                )
 
-        view_manager.register_exporter(exporter)
+                view_manager.register_exporter(self.__exporter)
 
         for view in views:
             view_manager.register_view(view)
 
-        stats_recorder = stats.stats_recorder
+    def bind(self, *measures: Any) -> BoundMeasures:
+        """Binds measures recorded together
+        :param measures: Measures to record together
+        :type measures: Measure
+        :returns: Handle recording the measures
+        :rtype: BoundMeasures
+        """
+
+        from opencensus.stats import stats as stats_module
+
+        return BoundMeasures(measures, stats_module.stats.stats_recorder)
+
+    def tag_map(self, *tags: Tuple[str, Optional[str]]) -> Any:
+        """Gets the tag map of a combination of tags, built once per combination.
+        Tags without value are left out
+        :param tags: Key and value of every tag, e.g. ("Status", "completed")
+        :type tags: Tuple[str, Optional[str]]
+        :returns: The tag map, must not be modified
+        :rtype: TagMap
+        """
+
+        tag_map = self.__tag_maps.get(tags)
+
+        if tag_map is None:
+            from opencensus.tags import tag_map as tag_map_module
 
-        self.MMAP = stats_recorder.new_measurement_map()
+            tag_map = tag_map_module.TagMap()
+
+            for key, value in tags:
+                if value is not None:
+                    tag_map.insert(key, value)
+
+            self.__tag_maps[tags] = tag_map
+
+        return tag_map
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Gets the metrics registry shared by the whole process
+    :returns: The registry
+    :rtype: MetricsRegistry
+    """
+
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+
+        return _registry
+
+
+class Metrics(object, metaclass=ABCMeta):
+    registry: Optional[MetricsRegistry] = None
+
+    def _register_views(self, views: Iterable[Any]) -> MetricsRegistry:
+        """
+        Registers the views of the provider with the registry shared by the
+        whole process, see MetricsRegistry
+        :param views: List of view to register
+        :returns: The registry
+        """
+
+        self.registry = get_metrics_registry()
+        self.registry.register_views(views)
+
+        return self.registry
 
     @abstractmethod
     def register_metrics(self) -> None:
@@ -45,21 +203,353 @@ class Metrics(object, metaclass=ABCMeta):
     def send_metrics(self, metrics: dict[str, Any]) -> None:
         pass
 
+    def send_stage_metrics(self, metrics: dict[str, Any]) -> None:
+        """
+        Records the latency statistics of a stage, see StageRecord. Ignored by
+        the providers that don't report stages
+        """
+
+        pass
+
+
+class MetricRecord(NamedTuple):
+    """Aggregate of the work done by a processor with the same outcome since the
+    previous export"""
+
+    processor: str
+    status: str
+    messages: int  # number of messages
+    size: int  # bytes processed
+    duration: float  # total processing time, in seconds
+    max_duration: float  # longest processing time of a single call, in seconds
+    lag: float = 0.0  # total time from enqueueing to settling the messages, in seconds
+    max_lag: float = 0.0  # longest time from enqueueing to settling a message, in seconds
+    deliveries: int = 0  # total delivery count of the messages, redeliveries included
+    interval: float = 0.0  # seconds covered by the record, i.e. since the previous export
+
+
+def message_rates(records: list[MetricRecord]) -> dict[str, Tuple[float, float]]:
+    """Computes the throughput and abandon rate of every processor, all outcomes
+    together
+    :param records: Records of the same export
+    :type records: list[MetricRecord]
+    :returns: Messages per second and fraction of the messages abandoned, keyed
+        by processor
+    :rtype: dict[str, Tuple[float, float]]
+    """
+
+    totals: dict[str, list[Any]] = {}
+
+    for record in records:
+        total = totals.setdefault(record.processor, [0, 0, record.interval])
+        total[0] += record.messages
+        total[1] += record.messages if record.status == "abandoned" else 0
+
+    return {
+        processor: (messages / interval if interval > 0 else 0.0, abandoned / messages)
+        for processor, (messages, abandoned, interval) in totals.items()
+        if messages
+    }
+
+
+class MetricsExporter(metaclass=ABCMeta):
+    """Destination of the aggregated metrics, called from the aggregator's
+    background thread"""
+
+    @abstractmethod
+    def export(self, records: list[MetricRecord]) -> None:
+        pass
+
+    def export_stages(self, records: list[StageRecord]) -> None:
+        """Exports the latency statistics of the stages, ignored by default"""
+
+        pass
+
+
+class InMemoryExporter(MetricsExporter):
+    """Keeps the exported records in memory, meant for tests and local runs"""
+
+    def __init__(self) -> None:
+        self.records: list[MetricRecord] = []
+        self.stage_records: list[StageRecord] = []
+
+    def export(self, records: list[MetricRecord]) -> None:
+        self.records.extend(records)
+
+    def export_stages(self, records: list[StageRecord]) -> None:
+        self.stage_records.extend(records)
+
+
+class LoggingExporter(MetricsExporter):
+    """Logs the exported records, used when App Insights isn't configured"""
+
+    def export(self, records: list[MetricRecord]) -> None:
+        for record in records:
+            logger.info(
+                "%s: %d %s messages, %d bytes, %.3f s (max %.3f s), queue lag max %.3f s",
+                record.processor,
+                record.messages,
+                record.status,
+                record.size,
+                record.duration,
+                record.max_duration,
+                record.max_lag,
+            )
+
+        for processor, (throughput, abandon_rate) in message_rates(records).items():
+            logger.info(
+                "%s: %.2f messages/s, %.1f%% abandoned",
+                processor,
+                throughput,
+                abandon_rate * 100,
+            )
+
+    def export_stages(self, records: list[StageRecord]) -> None:
+        for record in records:
+            logger.info(
+                "%s: %d calls, p50 %.1f ms, p95 %.1f ms, p99 %.1f ms (max %.1f ms)",
+                record.stage,
+                record.calls,
+                record.p50 * 1000,
+                record.p95 * 1000,
+                record.p99 * 1000,
+                record.max * 1000,
+            )
+
+
+class ProvidersExporter(MetricsExporter):
+    """Sends the exported records through registered metrics providers,
+    see MetricsFactory"""
+
+    def __init__(self, providers: list[Metrics]) -> None:
+        self.__providers = providers
+
+    def export(self, records: list[MetricRecord]) -> None:
+        rates = message_rates(records)
+
+        for record in records:
+            throughput, abandon_rate = rates.get(record.processor, (0.0, 0.0))
+            metrics = {
+                **record._asdict(),
+                "throughput": throughput,
+                "abandon_rate": abandon_rate,
+            }
+
+            for provider in self.__providers:
+                provider.send_metrics(metrics)
+
+    def export_stages(self, records: list[StageRecord]) -> None:
+        for record in records:
+            metrics = record._asdict()
+
+            for provider in self.__providers:
+                provider.send_stage_metrics(metrics)
+
+
+class MetricsAggregator:
+    """Aggregates the metrics recorded by the processor in memory and hands them
+    to an exporter in batches, from a background thread. Recording only updates
+    a counter under a lock so it never waits on the exporter. The latency
+    statistics of the stages are exported along with them"""
+
+    def __init__(
+        self,
+        exporter: MetricsExporter,
+        flush_interval: Optional[float] = None,
+        stage_timings: Optional[StageTimings] = None,
+    ) -> None:
+        """
+        :param exporter: Destination of the aggregated metrics
+        :type exporter: MetricsExporter
+        :param flush_interval: Seconds between two exports, defaults to
+            METRICS_FLUSH_INTERVAL
+        :type flush_interval: float
+        :param stage_timings: Timings of the stages to export, defaults to the
+            timings shared by the whole process
+        :type stage_timings: StageTimings
+        """
+
+        self.exporter = exporter
+        self.__flush_interval = flush_interval or METRICS_FLUSH_INTERVAL
+        self.__stage_timings = stage_timings or timings
+        # messages, size, duration, max duration, lag, max lag and deliveries, keyed
+        # by processor and status
+        self.__buckets: dict[Tuple[str, str], list[Any]] = {}
+        self.__window_started = time.monotonic()
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def record(
+        self,
+        processor: str,
+        status: str,
+        duration: float,
+        size: int = 0,
+        messages: int = 1,
+        lag: float = 0.0,
+        max_lag: Optional[float] = None,
+        deliveries: int = 0,
+    ) -> None:
+        """Records the processing of one or more messages
+        :param processor: Name of the processor
+        :type processor: str
+        :param status: Outcome of the processing, e.g. succeeded or failed
+        :type status: str
+        :param duration: Processing time, in seconds
+        :type duration: float
+        :param size: Bytes processed
+        :type size: int
+        :param messages: Number of messages processed
+        :type messages: int
+        :param lag: Total time from enqueueing to settling the messages, in seconds
+        :type lag: float
+        :param max_lag: Longest of these times, defaults to lag
+        :type max_lag: float
+        :param deliveries: Total delivery count of the messages
+        :type deliveries: int
+        :returns: None
+        :rtype: None
+        """
+
+        key = (processor, status)
+
+        if max_lag is None:
+            max_lag = lag
+
+        with self.__lock:
+            bucket = self.__buckets.get(key)
+
+            if bucket is None:
+                self.__buckets[key] = [
+                    messages,
+                    size,
+                    duration,
+                    duration,
+                    lag,
+                    max_lag,
+                    deliveries,
+                ]
+            else:
+                bucket[0] += messages
+                bucket[1] += size
+                bucket[2] += duration
+                bucket[3] = max(bucket[3], duration)
+                bucket[4] += lag
+                bucket[5] = max(bucket[5], max_lag)
+                bucket[6] += deliveries
+
+    def flush(self) -> None:
+        """Exports what was recorded since the previous export. Export errors are
+        logged, the metrics of a failed export are dropped
+        :returns: None
+        :rtype: None
+        """
+
+        now = time.monotonic()
+
+        with self.__lock:
+            buckets, self.__buckets = self.__buckets, {}
+            interval, self.__window_started = now - self.__window_started, now
+
+        stage_records = self.__stage_timings.drain()
+
+        if buckets:
+            records = [
+                MetricRecord._make((processor, status, *bucket, interval))
+                for (processor, status), bucket in buckets.items()
+            ]
+
+            try:
+                self.exporter.export(records)
+
+            except Exception as e:
+                logger.warning("Failed to export %d metric records", len(records), exc_info=e)
+
+        if stage_records:
+            try:
+                self.exporter.export_stages(stage_records)
+
+            except Exception as e:
+                logger.warning(
+                    "Failed to export %d stage records", len(stage_records), exc_info=e
+                )
+
+    def start(self) -> None:
+        """Starts exporting in the background, every flush interval
+        :returns: None
+        :rtype: None
+        """
+
+        if self.__thread is not None:
+            return
+
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, name="metrics", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Stops exporting in the background and exports what's left
+        :returns: None
+        :rtype: None
+        """
+
+        if self.__thread is not None:
+            self.__stopped.set()
+            self.__thread.join()
+            self.__thread = None
+
+        self.flush()
+
+    def __run(self) -> None:
+        while not self.__stopped.wait(self.__flush_interval):
+            self.flush()
+
+
+_aggregator: Optional[MetricsAggregator] = None
+_aggregator_lock = threading.Lock()
+
+
+def get_metrics_aggregator() -> MetricsAggregator:
+    """Gets the aggregator shared by the whole process, metrics are logged until
+    an exporter is configured
+    :returns: The aggregator
+    :rtype: MetricsAggregator
+    """
+
+    global _aggregator
+
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = MetricsAggregator(LoggingExporter())
+
+        return _aggregator
+
 
 def sendmetrics(func: Callable) -> Callable:
     """
-    Decorator to send metrics to App Insights
+    Decorator to send metrics to App Insights. The metrics recorded while the
+    decorated processor runs are exported in the background, and what's left of
+    them once it returns. The stage timings are also written to STAGE_TIMINGS_PATH,
+    when set
     """
 
+    @functools.wraps(func)
     def wrapper(*args: Tuple, **kwargs: dict[str, Any]) -> None:
         """
-        Wrapper to send the metrics at the end of a processor run
+        Wrapper to send the metrics during and at the end of a processor run
         """
 
-        func(*args, **kwargs)
+        aggregator = get_metrics_aggregator()
+        aggregator.start()
 
-        # todo: send metrics
+        try:
+            func(*args, **kwargs)
 
-        pass
+        finally:
+            aggregator.stop()
+
+            if STAGE_TIMINGS_PATH:
+                timings.dump(STAGE_TIMINGS_PATH)
 
     return wrapper
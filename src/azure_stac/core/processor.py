@@ -5,14 +5,67 @@
 
 import json
 import os
+import time
 from abc import ABCMeta, abstractmethod
-from typing import Any, Generator
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Generator, Optional, Tuple
 
 from knack.log import get_logger
+
+from azure_stac.common.__idempotency import IdempotencyIndex
 from azure_stac.common.__utilities import getenv
+from azure_stac.core.metrics import get_metrics_aggregator
 
 logger = get_logger(__name__)
 
+# seconds to wait for messages while others are being processed, so that the finished
+# ones are settled without waiting for a full MAX_WAIT_TIME
+IN_FLIGHT_WAIT_TIME = 1.0
+
+
+class _InlineExecutor(Executor):
+    """Executor running every task on the calling thread as soon as it's submitted,
+    see BaseProcessor.INLINE_HANDLERS"""
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+
+        except BaseException as e:
+            future.set_exception(e)
+
+        return future
+
+
+def _message_size(payload: Any) -> int:
+    """Gets the size of the blob an Event Grid message is about
+    :param payload: Decoded body of the message
+    :type payload: Any
+    :returns: Size of the blob in bytes, 0 when the message doesn't say
+    :rtype: int
+    """
+
+    data = payload.get("data") if isinstance(payload, dict) else None
+
+    return int(data.get("contentLength") or 0) if isinstance(data, dict) else 0
+
+
+def _message_lag(msg: Any, now: float) -> float:
+    """Gets the time a message spent since it was enqueued
+    :param msg: Message received from the subscription
+    :type msg: ServiceBusReceivedMessage
+    :param now: Current time, as returned by time.time()
+    :type now: float
+    :returns: Seconds since the message was enqueued, 0 when unknown
+    :rtype: float
+    """
+
+    enqueued_time = getattr(msg, "enqueued_time_utc", None)
+
+    return max(now - enqueued_time.timestamp(), 0.0) if enqueued_time is not None else 0.0
+
 
 class BaseProcessor(metaclass=ABCMeta):
     PROCESSOR_NAME = ""  # required, name of the processor
@@ -25,10 +78,63 @@ class BaseProcessor(metaclass=ABCMeta):
     WORKING_DIR = ""
     TEMP_FOLDER_NAME = "temp"
 
-    def __init__(self) -> None:
+    # receive settings, can be overridden through the environment
+    MAX_MESSAGE_COUNT = 10  # max number of messages pulled per receive call
+    # messages buffered locally ahead of time by process_batches, 0 = MAX_MESSAGE_COUNT.
+    # process_messages never prefetches, see there
+    PREFETCH_COUNT = 0
+    MAX_WAIT_TIME = 5.0  # seconds to wait for a batch to fill up before yielding it
+
+    # concurrency settings, can be overridden through the environment
+    MAX_CONCURRENCY = 1  # number of messages processed in parallel by process_messages
+    MAX_LOCK_RENEWAL_DURATION = 600.0  # seconds a message lock is kept alive while in flight
+    # run the handlers of process_messages on the calling thread, one message at a time,
+    # e.g. for cProfile to see them. Can be overridden through the constructor
+    INLINE_HANDLERS = False
+
+    # stop limits, can be overridden through the environment or the constructor, e.g. to
+    # profile a processor
+    MAX_MESSAGES = 0  # stop once this many messages were received, 0 = never
+    MAX_RUN_TIME = 0.0  # stop receiving messages after this many seconds, 0 = never
+
+    # metrics providers sent to App Insights, see MetricsFactory. Can be overridden
+    # through the environment as a comma separated list
+    METRIC_TYPES = ["data", "message", "pod", "stage"]
+
+    # SQLite database of the blobs already processed, disabled when empty. Set it
+    # through the environment to a path on a persistent volume, an index in the
+    # container's temp folder is lost, and then wrongly empty, on every restart
+    IDEMPOTENCY_INDEX_PATH = ""
+
+    def __init__(
+        self,
+        max_messages: Optional[int] = None,
+        max_run_time: Optional[float] = None,
+        inline_handlers: Optional[bool] = None,
+    ) -> None:
+        """
+        :param max_messages: Stop once this many messages were received, overrides
+            MAX_MESSAGES
+        :type max_messages: int
+        :param max_run_time: Stop receiving messages after this many seconds,
+            overrides MAX_RUN_TIME
+        :type max_run_time: float
+        :param inline_handlers: Run the handlers on the calling thread, overrides
+            INLINE_HANDLERS
+        :type inline_handlers: bool
+        """
+
         self.__check_integrity()
         self.__get_settings()
 
+        # given by the caller, e.g. the command line, they win over the environment
+        if max_messages is not None:
+            self.MAX_MESSAGES = max_messages
+        if max_run_time is not None:
+            self.MAX_RUN_TIME = max_run_time
+        if inline_handlers is not None:
+            self.INLINE_HANDLERS = inline_handlers
+
     def __clean_up(self) -> None:
         """Intended to clean up artifacts at the end of each data being processed"""
         import shutil
@@ -54,8 +160,30 @@ class BaseProcessor(metaclass=ABCMeta):
         Retrieve settings and configuration for setting up the base
         functionality for a processor
         """
-        self.TOPIC_NAME = getenv("TOPIC_NAME")
-        self.SUBSCRIPTION_NAME = getenv("SUBSCRIPTION_NAME")
+        self.MAX_MESSAGE_COUNT = int(getenv("MAX_MESSAGE_COUNT", str(self.MAX_MESSAGE_COUNT)))
+        self.PREFETCH_COUNT = (
+            int(getenv("PREFETCH_COUNT", str(self.PREFETCH_COUNT))) or self.MAX_MESSAGE_COUNT
+        )
+        self.MAX_WAIT_TIME = float(getenv("MAX_WAIT_TIME", str(self.MAX_WAIT_TIME)))
+
+        self.MAX_CONCURRENCY = int(getenv("MAX_CONCURRENCY", str(self.MAX_CONCURRENCY)))
+        self.MAX_LOCK_RENEWAL_DURATION = float(
+            getenv("MAX_LOCK_RENEWAL_DURATION", str(self.MAX_LOCK_RENEWAL_DURATION))
+        )
+
+        self.MAX_MESSAGES = int(getenv("MAX_MESSAGES", str(self.MAX_MESSAGES)))
+        self.MAX_RUN_TIME = float(getenv("MAX_RUN_TIME", str(self.MAX_RUN_TIME)))
+        self.__stopping = False
+
+        self.METRIC_TYPES = [
+            metric_type
+            for metric_type in getenv("METRIC_TYPES", ",".join(self.METRIC_TYPES)).split(",")
+            if metric_type
+        ]
+
+        self.IDEMPOTENCY_INDEX_PATH = getenv(
+            "IDEMPOTENCY_INDEX_PATH", self.IDEMPOTENCY_INDEX_PATH
+        )
 
     def __check_integrity(self) -> None:
         """
@@ -69,11 +197,13 @@ class BaseProcessor(metaclass=ABCMeta):
     def __configure_metrics(self, metric_types: Any = None) -> None:
         """
         This method wil configure the list of applicable metrics and make them
-        ready for the processor to send their metrics as needed.
+        ready for the processor to send their metrics as needed. Metrics are
+        only sent when App Insights is configured, they are logged otherwise
         """
+        from azure_stac.core.metrics import ProvidersExporter
         from azure_stac.metrics.__metrics_factory import MetricsFactory
 
-        if metric_types is not None:
+        if metric_types is not None and os.getenv("AZURE_LOG_CONNECTION_STRING"):
             metrics_client = [
                 MetricsFactory.get_metrics_provider(type) for type in metric_types
             ]
@@ -81,13 +211,84 @@ class BaseProcessor(metaclass=ABCMeta):
             for client in metrics_client:
                 client.register_metrics()
 
-    def begin_listening(self) -> Generator:
+            get_metrics_aggregator().exporter = ProvidersExporter(metrics_client)
+
+    def __record_metrics(
+        self, status: str, started: float, payloads: list[Any], messages: list[Any]
+    ) -> None:
+        """Records the processing of messages, it's exported in the background
+        :param status: Outcome of the processing, completed or abandoned
+        :type status: str
+        :param started: time.perf_counter() when the processing started
+        :type started: float
+        :param payloads: Decoded bodies of the processed messages, None for the
+            messages that couldn't be decoded
+        :type payloads: list[Any]
+        :param messages: Processed messages, as received from the subscription
+        :type messages: list[ServiceBusReceivedMessage]
+        :returns: None
+        :rtype: None
+        """
+
+        now = time.time()
+        lags = [_message_lag(msg, now) for msg in messages]
+
+        get_metrics_aggregator().record(
+            type(self).__name__,
+            status,
+            time.perf_counter() - started,
+            size=sum(_message_size(payload) for payload in payloads),
+            messages=len(messages),
+            lag=sum(lags),
+            max_lag=max(lags, default=0.0),
+            deliveries=sum(msg.delivery_count or 0 for msg in messages),
+        )
+
+    def open_idempotency_index(self) -> Optional[IdempotencyIndex]:
+        """Opens the index of the blobs this processor already processed, see
+        IdempotencyIndex. The records are kept apart per processor class. The index
+        is opt-in, IDEMPOTENCY_INDEX_PATH must point to a persistent volume shared
+        by the restarts of the processor
+        :returns: The index, or None when IDEMPOTENCY_INDEX_PATH is empty
+        :rtype: Optional[IdempotencyIndex]
+        """
+
+        if not self.IDEMPOTENCY_INDEX_PATH:
+            return None
+
+        return IdempotencyIndex(self.IDEMPOTENCY_INDEX_PATH, namespace=type(self).__name__)
+
+    def __receive_batches(
+        self,
+        auto_lock_renewer: Optional[Any] = None,
+        receive_limits: Optional[Callable[[], Tuple[int, float]]] = None,
+        prefetch_count: Optional[int] = None,
+    ) -> Generator:
         """
-        Starts using the topic's subscription to begin receiving messages
+        Opens the topic's subscription and keeps pulling batches of up to
+        MAX_MESSAGE_COUNT messages from it. Yields the receiver along with
+        each batch so that the caller can settle the messages. A batch may be
+        empty when nothing arrived within MAX_WAIT_TIME. Once MAX_MESSAGES
+        messages were received or MAX_RUN_TIME elapsed, a last empty batch is
+        yielded with the stopping flag set, for the caller to settle the messages
+        still in flight, and the subscription is closed
+        :param auto_lock_renewer: Optional AutoLockRenewer that every received
+            message gets registered with
+        :type auto_lock_renewer: AutoLockRenewer
+        :param receive_limits: Optional callable returning the max number of messages
+            and the max wait time of the next receive, called before every receive.
+            Defaults to MAX_MESSAGE_COUNT and MAX_WAIT_TIME
+        :type receive_limits: Callable[[], Tuple[int, float]]
+        :param prefetch_count: Optional number of messages buffered locally ahead of
+            the receives, defaults to PREFETCH_COUNT
+        :type prefetch_count: int
         """
         from azure.servicebus import ServiceBusClient
 
+        # only read when the subscription is opened, e.g. a backfill never needs them
         self.SERVICE_BUS_CONNECTION_STRING = getenv("SERVICE_BUS_CONNECTION_STRING")
+        self.TOPIC_NAME = getenv("TOPIC_NAME")
+        self.SUBSCRIPTION_NAME = getenv("SUBSCRIPTION_NAME")
 
         with ServiceBusClient.from_connection_string(
             conn_str=self.SERVICE_BUS_CONNECTION_STRING,
@@ -96,24 +297,253 @@ class BaseProcessor(metaclass=ABCMeta):
             retry_mode="fixed",
         ) as client:
             receiver = client.get_subscription_receiver(
-                topic_name=self.TOPIC_NAME, subscription_name=self.SUBSCRIPTION_NAME
+                topic_name=self.TOPIC_NAME,
+                subscription_name=self.SUBSCRIPTION_NAME,
+                prefetch_count=(
+                    self.PREFETCH_COUNT if prefetch_count is None else prefetch_count
+                ),
+                auto_lock_renewer=auto_lock_renewer,
             )
 
+            started = time.monotonic()
+            received = 0
+
             with receiver:
-                for msg in receiver:
-                    try:
-                        # send this message for processing
-                        yield json.loads(str(msg))
+                while True:
+                    max_message_count, max_wait_time = (
+                        receive_limits()
+                        if receive_limits is not None
+                        else (self.MAX_MESSAGE_COUNT, self.MAX_WAIT_TIME)
+                    )
+
+                    if self.MAX_MESSAGES:
+                        max_message_count = min(max_message_count, self.MAX_MESSAGES - received)
+
+                    if max_message_count <= 0 or (
+                        self.MAX_RUN_TIME and time.monotonic() - started >= self.MAX_RUN_TIME
+                    ):
+                        logger.info("Stop limit reached after %d messages", received)
+                        self.__stopping = True
+
+                        yield receiver, []
+                        return
+
+                    messages = receiver.receive_messages(
+                        max_message_count=max_message_count,
+                        max_wait_time=max_wait_time,
+                    )
+                    received += len(messages)
+
+                    yield receiver, messages
+
+    def begin_listening(self) -> Generator:
+        """
+        Starts using the topic's subscription to begin receiving messages. Messages
+        are pulled in batches but handed out and settled one at a time
+        """
+
+        for receiver, messages in self.__receive_batches():
+            for msg in messages:
+                payload = None
+                started = time.perf_counter()
+
+                try:
+                    # send this message for processing
+                    payload = json.loads(str(msg))
+                    yield payload
+
+                    # complete the msg
+                    receiver.complete_message(msg)
+                    self.__record_metrics("completed", started, [payload], [msg])
+
+                except Exception:
+                    # abandon the msg and move on
+                    receiver.abandon_message(msg)
+                    self.__record_metrics("abandoned", started, [payload], [msg])
+
+                # clean up after processing each message
+                self.__clean_up()
+
+    def begin_listening_batch(self) -> Generator:
+        """
+        Starts using the topic's subscription to begin receiving messages in
+        batches. Each batch is yielded as a list of messages and all of them
+        are settled together once the caller asks for the next batch
+        """
+
+        for receiver, messages in self.__receive_batches():
+            if not messages:
+                continue
+
+            batch = []
+            received = []
+
+            for msg in messages:
+                try:
+                    batch.append(json.loads(str(msg)))
+                    received.append(msg)
+
+                except Exception:
+                    # malformed msg, abandon it and keep the rest of the batch
+                    receiver.abandon_message(msg)
+                    self.__record_metrics("abandoned", time.perf_counter(), [None], [msg])
+
+            if not batch:
+                continue
 
-                        # complete the msg
-                        receiver.complete_message(msg)
+            started = time.perf_counter()
+
+            try:
+                # send this batch for processing
+                yield batch
+
+                settle = receiver.complete_message
+                status = "completed"
+
+            except Exception:
+                # abandon the whole batch
+                settle = receiver.abandon_message
+                status = "abandoned"
+
+            for msg in received:
+                settle(msg)
+
+            self.__record_metrics(status, started, batch, received)
+
+            # clean up after processing each batch
+            self.__clean_up()
+
+    def process_batches(self, handler: Callable[[list[dict[str, Any]]], None]) -> None:
+        """
+        Receives batches of messages from the topic's subscription and hands each
+        batch to a handler. All the messages of a batch are completed when the
+        handler returns and abandoned when the handler raises an exception
+        :param handler: Callable invoked with the decoded bodies of every batch
+        :type handler: Callable[[list[dict[str, Any]]], None]
+        :returns: None
+        :rtype: None
+        """
+
+        batches = self.begin_listening_batch()
+        batch = next(batches, None)
+
+        # the generator ends once a stop limit is reached
+        while batch is not None:
+            try:
+                handler(batch)
+
+            except Exception as e:
+                logger.error("Failed to process a batch of %d messages", len(batch), exc_info=e)
+
+                # let the generator abandon the batch, it hands back the next one
+                try:
+                    batch = batches.throw(e)
+
+                except StopIteration:
+                    batch = None
+
+            else:
+                batch = next(batches, None)
+
+    def process_messages(self, handler: Callable[[dict[str, Any]], None]) -> None:
+        """
+        Receives messages from the topic's subscription and dispatches each of them
+        to a pool of MAX_CONCURRENCY worker threads. Only as many messages as there
+        are free workers are received, so no message waits for a worker while its
+        lock runs. Message locks are renewed in the background while a message is
+        being worked on. A message is completed when its handler returns and
+        abandoned when its handler raises an exception, finished messages are
+        settled before every receive. With INLINE_HANDLERS, the messages are
+        processed one at a time on the calling thread instead
+        :param handler: Callable invoked with the decoded body of every message
+        :type handler: Callable[[dict[str, Any]], None]
+        :returns: None
+        :rtype: None
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        from azure.servicebus import AutoLockRenewer, ServiceBusReceivedMessage
+
+        concurrency = 1 if self.INLINE_HANDLERS else self.MAX_CONCURRENCY
+        pool: Executor = (
+            _InlineExecutor()
+            if self.INLINE_HANDLERS
+            else ThreadPoolExecutor(max_workers=concurrency)
+        )
+
+        in_flight: dict[Future, ServiceBusReceivedMessage] = {}
+
+        def run_handler(payload: dict[str, Any], msg: ServiceBusReceivedMessage) -> None:
+            # timed on the worker, the outcome decides how the message is settled
+            started = time.perf_counter()
+
+            try:
+                handler(payload)
+
+            except Exception as e:
+                self.__record_metrics("abandoned", started, [payload], [msg])
+                raise e
+
+            self.__record_metrics("completed", started, [payload], [msg])
+
+        def settle(receiver: Any, done: set[Future]) -> None:
+            for future in done:
+                msg = in_flight.pop(future)
+                error = future.exception()
+
+                if error is None:
+                    receiver.complete_message(msg)
+                else:
+                    logger.error("Failed to process message %s", msg.message_id, exc_info=error)
+                    receiver.abandon_message(msg)
+
+            # temp artifacts can only be removed once no worker is using them
+            if done and not in_flight:
+                self.__clean_up()
+
+        def receive_limits() -> Tuple[int, float]:
+            # a worker is always free when the next batch is received
+            free_workers = concurrency - len(in_flight)
+            max_wait_time = (
+                min(self.MAX_WAIT_TIME, IN_FLIGHT_WAIT_TIME)
+                if in_flight
+                else self.MAX_WAIT_TIME
+            )
+
+            return min(self.MAX_MESSAGE_COUNT, free_workers), max_wait_time
+
+        with AutoLockRenewer(
+            max_lock_renewal_duration=self.MAX_LOCK_RENEWAL_DURATION
+        ) as renewer, pool:
+            # prefetched messages are locked while they wait in the client's buffer,
+            # before they are registered with the lock renewer, so that they could
+            # expire behind slow messages. Only the messages the free workers can
+            # take are pulled
+            for receiver, messages in self.__receive_batches(
+                auto_lock_renewer=renewer, receive_limits=receive_limits, prefetch_count=0
+            ):
+                for msg in messages:
+                    try:
+                        payload = json.loads(str(msg))
 
                     except Exception:
-                        # abandon the msg and move on
+                        # malformed msg, abandon it and move on
                         receiver.abandon_message(msg)
+                        self.__record_metrics("abandoned", time.perf_counter(), [None], [msg])
+                        continue
+
+                    in_flight[pool.submit(run_handler, payload, msg)] = msg
+
+                # wait for a free worker before pulling more messages
+                while len(in_flight) >= concurrency:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    settle(receiver, done)
 
-                    # clean up after processing each message
-                    self.__clean_up()
+                if self.__stopping:
+                    # settle what's left before the subscription is closed
+                    settle(receiver, wait(in_flight).done)
+                else:
+                    settle(receiver, {future for future in in_flight if future.done()})
 
     @abstractmethod
     def run(self, **kwargs: dict[str, Any]) -> None:
@@ -122,4 +552,4 @@ class BaseProcessor(metaclass=ABCMeta):
         implement their custom logic.
         """
 
-        self.__configure_metrics()
+        self.__configure_metrics(self.METRIC_TYPES)
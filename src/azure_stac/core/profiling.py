@@ -0,0 +1,189 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from abc import ABCMeta, abstractmethod
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+PROFILE_MODES = ("cprofile", "sampling")
+
+# seconds between two samples of the sampling profiler
+SAMPLING_INTERVAL = 0.005
+
+
+class Profiler(metaclass=ABCMeta):
+    """Profiles the process between start and stop"""
+
+    @abstractmethod
+    def start(self) -> None:
+        pass
+
+    @abstractmethod
+    def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    def write(self, path: str) -> None:
+        """Writes the profile to a file
+        :param path: Path to the file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+
+    @abstractmethod
+    def summary(self, limit: int = 20) -> str:
+        """Summarizes the functions the most time was spent in
+        :param limit: Number of functions
+        :type limit: int
+        :returns: The summary, as a table
+        :rtype: str
+        """
+
+
+class CProfileProfiler(Profiler):
+    """Deterministic profiler of the main thread only. cProfile profiles the thread
+    it's enabled in, and from Python 3.12 a single profiler can be active at once,
+    so processors profiled with it process their messages on the main thread, see
+    BaseProcessor.INLINE_HANDLERS. Other threads are left out, use the sampling
+    profiler to see them. Written as a pstats file, e.g. for snakeviz or gprof2dot"""
+
+    def __init__(self) -> None:
+        self.__profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        self.__profiler.enable()
+
+    def stop(self) -> None:
+        self.__profiler.disable()
+
+    def __stats(self, stream: Optional[io.StringIO] = None) -> pstats.Stats:
+        # stop before reading, the stats of a running profiler are incomplete
+        self.stop()
+
+        return pstats.Stats(self.__profiler, stream=stream)  # type: ignore
+
+    def write(self, path: str) -> None:
+        self.__stats().dump_stats(path)
+
+    def summary(self, limit: int = 20) -> str:
+        stream = io.StringIO()
+        self.__stats(stream).sort_stats("cumulative").print_stats(limit)
+
+        return stream.getvalue()
+
+
+class SamplingProfiler(Profiler):
+    """Statistical profiler, samples the stacks of all the threads from a background
+    thread at a fixed interval. Its overhead doesn't depend on the number of calls,
+    so it's fit for profiling under a real workload. Written as folded stacks, the
+    input of flamegraph.pl, speedscope or inferno"""
+
+    def __init__(self, interval: Optional[float] = None) -> None:
+        """
+        :param interval: Seconds between two samples, defaults to SAMPLING_INTERVAL
+        :type interval: float
+        """
+
+        self.__interval = interval or SAMPLING_INTERVAL
+        self.__stacks: Counter[str] = Counter()
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+        self.samples = 0
+
+    @staticmethod
+    def __frame_name(frame: FrameType) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def __sample(self) -> None:
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            stack = []
+            current: Optional[FrameType] = frame
+
+            while current is not None:
+                stack.append(self.__frame_name(current))
+                current = current.f_back
+
+            # root first, each thread is a root of the flame graph
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.__stacks[";".join(reversed(stack))] += 1
+
+        self.samples += 1
+
+    def __run(self) -> None:
+        while not self.__stopped.wait(self.__interval):
+            self.__sample()
+
+    def start(self) -> None:
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, name="profiler", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        if self.__thread is not None:
+            self.__stopped.set()
+            self.__thread.join()
+            self.__thread = None
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as fh:
+            for stack, count in self.__stacks.most_common():
+                fh.write(f"{stack} {count}\n")
+
+    def summary(self, limit: int = 20) -> str:
+        own: Counter[str] = Counter()
+        total: Counter[str] = Counter()
+
+        for stack, count in self.__stacks.items():
+            frames = stack.split(";")[1:]
+
+            if not frames:
+                continue
+
+            own[frames[-1]] += count
+
+            # recursive functions are counted once per sample
+            for frame in set(frames):
+                total[frame] += count
+
+        samples = sum(self.__stacks.values()) or 1
+        lines = [f"{self.samples} samples, every {self.__interval * 1000:g} ms", ""]
+        lines.append(f"{'own %':>7} {'total %':>8}  function")
+
+        for frame, count in own.most_common(limit):
+            lines.append(f"{count / samples:7.1%} {total[frame] / samples:8.1%}  {frame}")
+
+        return "\n".join(lines) + "\n"
+
+
+def get_profiler(mode: str) -> Profiler:
+    """Creates a profiler
+    :param mode: cprofile or sampling, see PROFILE_MODES
+    :type mode: str
+    :returns: The profiler
+    :rtype: Profiler
+    """
+
+    if mode == "cprofile":
+        return CProfileProfiler()
+    elif mode == "sampling":
+        return SamplingProfiler()
+    raise ValueError(
+        f"Invalid profile mode: {mode}, expected one of {', '.join(PROFILE_MODES)}"
+    )
@@ -0,0 +1,213 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import json
+import threading
+import time
+from bisect import bisect_right
+from types import TracebackType
+from typing import Any, NamedTuple, Optional, Type
+
+# upper bounds of the histogram buckets, in seconds. Buckets grow by 25% from 100us
+# to about 8 minutes, so percentiles are estimated within about 12% of their value
+BUCKET_BOUNDARIES = [0.0001 * 1.25**index for index in range(70)]
+
+
+class StageRecord(NamedTuple):
+    """Latency statistics of a stage, durations are in seconds"""
+
+    stage: str
+    calls: int  # number of times the stage ran
+    total: float
+    max: float
+    p50: float
+    p95: float
+    p99: float
+
+
+class StageHistogram:
+    """Histogram of the durations of a stage, with log-spaced buckets"""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKET_BOUNDARIES) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, duration: float, bucket: int) -> None:
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += duration
+
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+
+    def percentile(self, quantile: float) -> float:
+        """Estimates a percentile, interpolating within the bucket it falls in
+        :param quantile: Quantile between 0 and 1, e.g. 0.95
+        :type quantile: float
+        :returns: Estimated duration, in seconds
+        :rtype: float
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = quantile * self.count
+        seen = 0
+
+        for index, bucket in enumerate(self.buckets):
+            if bucket and seen + bucket >= rank:
+                lower = BUCKET_BOUNDARIES[index - 1] if index > 0 else 0.0
+                upper = BUCKET_BOUNDARIES[index] if index < len(BUCKET_BOUNDARIES) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket
+
+                # the exact extremes are known, keep the estimate within them
+                return min(max(estimate, self.min), self.max)
+
+            seen += bucket
+
+        return self.max
+
+    def to_record(self, stage: str) -> StageRecord:
+        return StageRecord(
+            stage,
+            self.count,
+            self.total,
+            self.max,
+            self.percentile(0.5),
+            self.percentile(0.95),
+            self.percentile(0.99),
+        )
+
+
+class StageTimings:
+    """Latency histograms of the stages of a processor. Every stage reports its
+    durations through `span` or `record`. The histograms accumulate for the life
+    of the process, a second set is reset each time it's drained for export"""
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__totals: dict[str, StageHistogram] = {}
+        self.__window: dict[str, StageHistogram] = {}
+
+    def record(self, stage: str, duration: float) -> None:
+        """Records the duration of a stage
+        :param stage: Name of the stage, e.g. naip.create_item
+        :type stage: str
+        :param duration: Duration, in seconds
+        :type duration: float
+        :returns: None
+        :rtype: None
+        """
+
+        bucket = bisect_right(BUCKET_BOUNDARIES, duration)
+
+        with self.__lock:
+            for histograms in (self.__totals, self.__window):
+                histogram = histograms.get(stage)
+
+                if histogram is None:
+                    histogram = histograms[stage] = StageHistogram()
+
+                histogram.add(duration, bucket)
+
+    def span(self, stage: str) -> "Span":
+        """Times the enclosed block as a stage, failures included
+        :param stage: Name of the stage, e.g. naip.create_item
+        :type stage: str
+        :returns: Context manager timing the block
+        :rtype: Span
+        """
+
+        return Span(self, stage)
+
+    def drain(self) -> list[StageRecord]:
+        """Gets the statistics of the stages since the previous drain
+        :returns: Statistics of every stage that ran since then
+        :rtype: list[StageRecord]
+        """
+
+        with self.__lock:
+            window, self.__window = self.__window, {}
+
+        return [histogram.to_record(stage) for stage, histogram in window.items()]
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """Gets the statistics of the stages since the start of the process, in
+        milliseconds
+        :returns: Statistics keyed by stage
+        :rtype: dict[str, dict[str, Any]]
+        """
+
+        with self.__lock:
+            records = [histogram.to_record(stage) for stage, histogram in self.__totals.items()]
+
+        return {
+            record.stage: {
+                "calls": record.calls,
+                "mean_ms": record.total * 1000 / record.calls,
+                "p50_ms": record.p50 * 1000,
+                "p95_ms": record.p95 * 1000,
+                "p99_ms": record.p99 * 1000,
+                "max_ms": record.max * 1000,
+            }
+            for record in sorted(records, key=lambda record: record.total, reverse=True)
+        }
+
+    def dump(self, path: str) -> None:
+        """Writes the statistics of the stages since the start of the process to
+        a JSON file, slowest stages (by total time) first
+        :param path: Path to the JSON file
+        :type path: str
+        :returns: None
+        :rtype: None
+        """
+
+        with open(path, "w") as fh:
+            json.dump(self.snapshot(), fh, indent=2)
+
+
+class Span:
+    """Context manager recording the duration of the enclosed block, see
+    StageTimings.span"""
+
+    __slots__ = ("timings", "stage", "started")
+
+    def __init__(self, timings: StageTimings, stage: str) -> None:
+        self.timings = timings
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self) -> "Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.timings.record(self.stage, time.perf_counter() - self.started)
+
+
+# timings shared by the whole process
+timings = StageTimings()
+
+
+def span(stage: str) -> Span:
+    """Times the enclosed block as a stage of the process-wide timings, e.g.
+    `with span("naip.create_item"): ...`
+    :param stage: Name of the stage
+    :type stage: str
+    :returns: Context manager timing the block
+    :rtype: Span
+    """
+
+    return timings.span(stage)
@@ -3,10 +3,11 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+from azure_stac.core.metrics import Metrics
 from azure_stac.metrics.data_metrics import DataMetrics
 from azure_stac.metrics.message_metrics import MessageMetrics
 from azure_stac.metrics.pod_metrics import PodMetrics
-from azure_stac.core.metrics import Metrics
+from azure_stac.metrics.stage_metrics import StageMetrics
 
 
 class MetricsFactory:
@@ -22,4 +23,6 @@ class MetricsFactory:
             return MessageMetrics()
         elif metric_type == "pod":
             return PodMetrics()
+        elif metric_type == "stage":
+            return StageMetrics()
         raise ValueError(f"Invalid metric type: {metric_type}")
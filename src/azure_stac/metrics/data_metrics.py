@@ -3,9 +3,8 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-import os
-
 from typing import Any
+
 from typing_extensions import override
 
 from azure_stac.core.metrics import Metrics
@@ -15,7 +14,8 @@ class DataMetrics(Metrics):
     @override
     def register_metrics(self) -> None:
         """
-        Register the data metrics including data size
+        Register the data metrics including data size, number of messages and
+        processing time
         """
 
         from opencensus.stats import aggregation as aggregation_module
@@ -27,43 +27,65 @@ class DataMetrics(Metrics):
             "data_size", "Size of message being processed", "bytes"
         )
 
+        self.messages_measure = measure_module.MeasureInt(
+            "messages", "Number of messages processed", "messages"
+        )
+
+        self.processing_time_measure = measure_module.MeasureFloat(
+            "processing_time", "Time spent processing messages", "ms"
+        )
+
+        tag_keys = [
+            tag_key_module.TagKey("Pod Name"),
+            tag_key_module.TagKey("Status"),
+            tag_key_module.TagKey("Processor"),
+        ]
+
         data_size_view = view_module.View(
             "Data Size",
             "Total size of data being processed",
-            [
-                tag_key_module.TagKey("Pod Name"),
-                tag_key_module.TagKey("Status"),
-                tag_key_module.TagKey("Processor"),
-            ],
+            tag_keys,
             self.data_size_measure,
             aggregation_module.SumAggregation(),
         )
 
-        self._setup_open_census([data_size_view])
+        messages_view = view_module.View(
+            "Messages Processed",
+            "Total number of messages processed",
+            tag_keys,
+            self.messages_measure,
+            aggregation_module.SumAggregation(),
+        )
+
+        processing_time_view = view_module.View(
+            "Processing Time",
+            "Total time spent processing messages",
+            tag_keys,
+            self.processing_time_measure,
+            aggregation_module.SumAggregation(),
+        )
+
+        registry = self._register_views([data_size_view, messages_view, processing_time_view])
+
+        self.measures = registry.bind(
+            self.data_size_measure, self.messages_measure, self.processing_time_measure
+        )
 
     @override
     def send_metrics(self, metrics: dict[str, Any]) -> None:
         """
         Records the metrics to App Insights
-        :param size: Metric Value
+        :param metrics: Aggregated metrics, see MetricRecord
         """
 
-        from opencensus.tags import tag_map as tag_map_module
-
-        pod_name = os.getenv("POD_NAME")
-
-        if not self.MMAP:
+        if not self.registry:
             raise Exception("Metrics have not been registered")
 
-        self.MMAP.measure_int_put(self.data_size_measure, metrics["size"])
-
-        if pod_name is not None:
-            tagMap = tag_map_module.TagMap()
-
-            tagMap.insert("Pod Name", metrics["pod_name"])
-            tagMap.insert("Status", metrics["status"])
-            tagMap.insert("Processor", metrics["processor"])
-
-            self.MMAP.record(tagMap)
-        else:
-            self.MMAP.record()
+        self.measures.record(
+            (metrics["size"], metrics["messages"], metrics["duration"] * 1000),
+            self.registry.tag_map(
+                ("Pod Name", self.registry.pod_name),
+                ("Status", metrics["status"]),
+                ("Processor", metrics["processor"]),
+            ),
+        )
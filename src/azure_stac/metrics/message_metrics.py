@@ -4,15 +4,136 @@
 # --------------------------------------------------------------------------------------------
 
 from typing import Any
+
 from typing_extensions import override
+
 from azure_stac.core.metrics import Metrics
 
 
 class MessageMetrics(Metrics):
     @override
     def register_metrics(self) -> None:
-        pass
+        """
+        Register the message metrics including queue lag (time from enqueueing to
+        settling a message), delivery count, throughput and abandon rate
+        """
+
+        from opencensus.stats import aggregation as aggregation_module
+        from opencensus.stats import measure as measure_module
+        from opencensus.stats import view as view_module
+        from opencensus.tags import tag_key as tag_key_module
+
+        self.queue_lag_measure = measure_module.MeasureFloat(
+            "queue_lag", "Time from enqueueing to settling messages", "ms"
+        )
+
+        self.max_queue_lag_measure = measure_module.MeasureFloat(
+            "max_queue_lag", "Longest time from enqueueing to settling a message", "ms"
+        )
+
+        self.deliveries_measure = measure_module.MeasureInt(
+            "deliveries", "Number of deliveries of the messages processed", "deliveries"
+        )
+
+        self.throughput_measure = measure_module.MeasureFloat(
+            "throughput", "Messages processed per second", "messages/s"
+        )
+
+        self.abandon_rate_measure = measure_module.MeasureFloat(
+            "abandon_rate", "Fraction of the messages abandoned", "1"
+        )
+
+        tag_keys = [
+            tag_key_module.TagKey("Pod Name"),
+            tag_key_module.TagKey("Status"),
+            tag_key_module.TagKey("Processor"),
+        ]
+
+        # rates cover all the outcomes of a processor
+        rate_tag_keys = [tag_key_module.TagKey("Pod Name"), tag_key_module.TagKey("Processor")]
+
+        queue_lag_view = view_module.View(
+            "Queue Lag",
+            "Total time from enqueueing to settling messages",
+            tag_keys,
+            self.queue_lag_measure,
+            aggregation_module.SumAggregation(),
+        )
+
+        max_queue_lag_view = view_module.View(
+            "Max Queue Lag",
+            "Longest time from enqueueing to settling a message",
+            tag_keys,
+            self.max_queue_lag_measure,
+            aggregation_module.LastValueAggregation(),
+        )
+
+        deliveries_view = view_module.View(
+            "Deliveries",
+            "Total number of deliveries of the messages processed",
+            tag_keys,
+            self.deliveries_measure,
+            aggregation_module.SumAggregation(),
+        )
+
+        throughput_view = view_module.View(
+            "Throughput",
+            "Messages processed per second",
+            rate_tag_keys,
+            self.throughput_measure,
+            aggregation_module.LastValueAggregation(),
+        )
+
+        abandon_rate_view = view_module.View(
+            "Abandon Rate",
+            "Fraction of the messages abandoned",
+            rate_tag_keys,
+            self.abandon_rate_measure,
+            aggregation_module.LastValueAggregation(),
+        )
+
+        registry = self._register_views(
+            [
+                queue_lag_view,
+                max_queue_lag_view,
+                deliveries_view,
+                throughput_view,
+                abandon_rate_view,
+            ]
+        )
+
+        self.measures = registry.bind(
+            self.queue_lag_measure,
+            self.max_queue_lag_measure,
+            self.deliveries_measure,
+            self.throughput_measure,
+            self.abandon_rate_measure,
+        )
 
     @override
     def send_metrics(self, metrics: dict[str, Any]) -> None:
-        pass
+        """
+        Records the metrics to App Insights
+        :param metrics: Aggregated metrics, see MetricRecord, along with the
+            throughput and abandon rate of the processor
+        """
+
+        if not self.registry:
+            raise Exception("Metrics have not been registered")
+
+        # the rates are the same for every outcome of a processor, their views
+        # ignore the status
+        self.measures.record(
+            (
+                metrics["lag"] * 1000,
+                metrics["max_lag"] * 1000,
+                metrics["deliveries"],
+                metrics["throughput"],
+                metrics["abandon_rate"],
+            ),
+            self.registry.tag_map(
+                ("Pod Name", self.registry.pod_name),
+                ("Status", metrics["status"]),
+                ("Processor", metrics["processor"]),
+            ),
+        )
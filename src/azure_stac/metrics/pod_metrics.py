@@ -3,16 +3,223 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-from typing import Any
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+from knack.log import get_logger
 from typing_extensions import override
-from azure_stac.core.metrics import Metrics
+
+from azure_stac.core.metrics import METRICS_FLUSH_INTERVAL, Metrics
+
+logger = get_logger(__name__)
+
+
+class PodSample(NamedTuple):
+    """Resource usage of the processor's process and of its temp disk"""
+
+    cpu: float  # CPU time used since the previous sample, in percent of one core
+    rss: int  # resident memory, in bytes
+    open_fds: int  # number of open file descriptors
+    temp_disk_used: int  # bytes used on the file system of the temp folder
+    temp_disk_usage: float  # fraction of that file system used
+
+
+def _read_rss() -> int:
+    """Gets the resident memory of the process from /proc, 0 when unavailable"""
+
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _count_open_fds() -> int:
+    """Gets the number of open file descriptors of the process from /proc, 0 when
+    unavailable"""
+
+    try:
+        return len(os.listdir("/proc/self/fd"))
+
+    except OSError:
+        return 0
+
+
+class PodSampler:
+    """Samples the resource usage of the process on a background thread and hands
+    every sample to a callback"""
+
+    def __init__(
+        self, callback: Callable[[PodSample], None], interval: Optional[float] = None
+    ) -> None:
+        """
+        :param callback: Called with every sample, from the sampler's thread
+        :type callback: Callable[[PodSample], None]
+        :param interval: Seconds between two samples, defaults to
+            METRICS_FLUSH_INTERVAL
+        :type interval: float
+        """
+
+        self.__callback = callback
+        self.__interval = interval or METRICS_FLUSH_INTERVAL
+        self.__stopped = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+        self.__last_cpu = self.__cpu_time()
+        self.__last_sampled = time.monotonic()
+
+    @staticmethod
+    def __cpu_time() -> float:
+        times = os.times()
+        return times.user + times.system
+
+    def sample(self) -> PodSample:
+        """Samples the resource usage, the CPU usage covers the time since the
+        previous sample
+        :returns: The sample
+        :rtype: PodSample
+        """
+
+        now = time.monotonic()
+        cpu_time = self.__cpu_time()
+        elapsed = now - self.__last_sampled
+        cpu = (cpu_time - self.__last_cpu) / elapsed * 100 if elapsed > 0 else 0.0
+        self.__last_cpu, self.__last_sampled = cpu_time, now
+
+        disk = shutil.disk_usage(tempfile.gettempdir())
+
+        return PodSample(
+            cpu=cpu,
+            rss=_read_rss(),
+            open_fds=_count_open_fds(),
+            temp_disk_used=disk.used,
+            temp_disk_usage=disk.used / disk.total if disk.total else 0.0,
+        )
+
+    def start(self) -> None:
+        """Starts sampling in the background, every interval
+        :returns: None
+        :rtype: None
+        """
+
+        if self.__thread is not None:
+            return
+
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, name="pod-metrics", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling in the background
+        :returns: None
+        :rtype: None
+        """
+
+        if self.__thread is not None:
+            self.__stopped.set()
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self) -> None:
+        while not self.__stopped.wait(self.__interval):
+            try:
+                self.__callback(self.sample())
+
+            except Exception as e:
+                logger.warning("Failed to record the pod metrics", exc_info=e)
 
 
 class PodMetrics(Metrics):
     @override
     def register_metrics(self) -> None:
-        pass
+        """
+        Register the pod metrics including CPU, memory, open file descriptors and
+        temp disk usage, and start sampling them in the background
+        """
+
+        from opencensus.stats import aggregation as aggregation_module
+        from opencensus.stats import measure as measure_module
+        from opencensus.stats import view as view_module
+        from opencensus.tags import tag_key as tag_key_module
+
+        self.cpu_measure = measure_module.MeasureFloat(
+            "cpu", "CPU used by the processor, in percent of one core", "%"
+        )
+
+        self.rss_measure = measure_module.MeasureInt(
+            "rss", "Resident memory of the processor", "bytes"
+        )
+
+        self.open_fds_measure = measure_module.MeasureInt(
+            "open_fds", "Open file descriptors of the processor", "fds"
+        )
+
+        self.temp_disk_used_measure = measure_module.MeasureInt(
+            "temp_disk_used", "Space used on the temp disk", "bytes"
+        )
+
+        self.temp_disk_usage_measure = measure_module.MeasureFloat(
+            "temp_disk_usage", "Fraction of the temp disk used", "1"
+        )
+
+        tag_keys = [tag_key_module.TagKey("Pod Name")]
+
+        views = [
+            view_module.View(
+                name,
+                description,
+                tag_keys,
+                measure,
+                aggregation_module.LastValueAggregation(),
+            )
+            for name, description, measure in (
+                ("CPU Usage", "CPU used by the processor", self.cpu_measure),
+                ("Memory Usage", "Resident memory of the processor", self.rss_measure),
+                ("Open Files", "Open file descriptors of the processor", self.open_fds_measure),
+                ("Temp Disk Used", "Space used on the temp disk", self.temp_disk_used_measure),
+                (
+                    "Temp Disk Usage",
+                    "Fraction of the temp disk used",
+                    self.temp_disk_usage_measure,
+                ),
+            )
+        ]
+
+        registry = self._register_views(views)
+
+        self.measures = registry.bind(
+            self.cpu_measure,
+            self.rss_measure,
+            self.open_fds_measure,
+            self.temp_disk_used_measure,
+            self.temp_disk_usage_measure,
+        )
+
+        self.sampler = PodSampler(self.__record_sample)
+        self.sampler.start()
 
     @override
     def send_metrics(self, metrics: dict[str, Any]) -> None:
+        """
+        Pod metrics are sampled in the background, nothing to record per message
+        """
+
         pass
+
+    def __record_sample(self, sample: PodSample) -> None:
+        """
+        Records a sample of the pod metrics to App Insights
+        :param sample: Resource usage of the processor
+        """
+
+        if not self.registry:
+            raise Exception("Metrics have not been registered")
+
+        # the measures are bound in the order of the fields of the sample
+        self.measures.record(
+            sample, self.registry.tag_map(("Pod Name", self.registry.pod_name))
+        )
@@ -0,0 +1,108 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+from typing import Any
+
+from typing_extensions import override
+
+from azure_stac.core.metrics import Metrics
+
+
+class StageMetrics(Metrics):
+    @override
+    def register_metrics(self) -> None:
+        """
+        Register the stage metrics including the number of calls, total time and
+        latency percentiles of every stage of the processors, see core.timing
+        """
+
+        from opencensus.stats import aggregation as aggregation_module
+        from opencensus.stats import measure as measure_module
+        from opencensus.stats import view as view_module
+        from opencensus.tags import tag_key as tag_key_module
+
+        self.stage_calls_measure = measure_module.MeasureInt(
+            "stage_calls", "Number of times a stage ran", "calls"
+        )
+
+        self.stage_time_measure = measure_module.MeasureFloat(
+            "stage_time", "Time spent in a stage", "ms"
+        )
+
+        self.stage_latency_measures = {
+            percentile: measure_module.MeasureFloat(
+                f"stage_latency_{percentile}", f"{percentile} latency of a stage", "ms"
+            )
+            for percentile in ("p50", "p95", "p99")
+        }
+
+        tag_keys = [tag_key_module.TagKey("Pod Name"), tag_key_module.TagKey("Stage")]
+
+        stage_calls_view = view_module.View(
+            "Stage Calls",
+            "Total number of times a stage ran",
+            tag_keys,
+            self.stage_calls_measure,
+            aggregation_module.SumAggregation(),
+        )
+
+        stage_time_view = view_module.View(
+            "Stage Time",
+            "Total time spent in a stage",
+            tag_keys,
+            self.stage_time_measure,
+            aggregation_module.SumAggregation(),
+        )
+
+        # percentiles of the latest export interval
+        stage_latency_views = [
+            view_module.View(
+                f"Stage Latency {percentile}",
+                f"{percentile} latency of a stage",
+                tag_keys,
+                measure,
+                aggregation_module.LastValueAggregation(),
+            )
+            for percentile, measure in self.stage_latency_measures.items()
+        ]
+
+        registry = self._register_views(
+            [stage_calls_view, stage_time_view, *stage_latency_views]
+        )
+
+        self.measures = registry.bind(
+            self.stage_calls_measure,
+            self.stage_time_measure,
+            *self.stage_latency_measures.values(),
+        )
+
+    @override
+    def send_metrics(self, metrics: dict[str, Any]) -> None:
+        """
+        Stage metrics are sent by send_stage_metrics, nothing to record per message
+        """
+
+        pass
+
+    @override
+    def send_stage_metrics(self, metrics: dict[str, Any]) -> None:
+        """
+        Records the stage metrics to App Insights
+        :param metrics: Latency statistics of a stage, see StageRecord
+        """
+
+        if not self.registry:
+            raise Exception("Metrics have not been registered")
+
+        self.measures.record(
+            (
+                metrics["calls"],
+                metrics["total"] * 1000,
+                *(metrics[percentile] * 1000 for percentile in self.stage_latency_measures),
+            ),
+            self.registry.tag_map(
+                ("Pod Name", self.registry.pod_name), ("Stage", metrics["stage"])
+            ),
+        )
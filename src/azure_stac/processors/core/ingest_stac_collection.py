@@ -3,13 +3,24 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-from typing import Any, Optional
+import threading
+import time
+from typing import Any
 
-from psycopg import Connection
+from knack.log import get_logger
+from psycopg.types.json import Jsonb
 
 from azure_stac.core.metrics import sendmetrics
 from azure_stac.core.processor import BaseProcessor
 
+logger = get_logger(__name__)
+
+# statements used to ingest a collection, by ingestion method
+COLLECTION_STATEMENTS = {
+    "insert": "SELECT pgstac.create_collection(%s)",
+    "upsert": "SELECT pgstac.upsert_collection(%s)",
+}
+
 
 class StacCol2Postgres(BaseProcessor):
     TEMPLATE_NAME = "Ingest STAC Collection"
@@ -23,8 +34,16 @@ class StacCol2Postgres(BaseProcessor):
     CONN_STRING = ""
     CONTAINER_NAME = ""
 
-    def __init__(self) -> None:
-        super().__init__()
+    # connection pool settings, can be overridden through the environment
+    PG_POOL_MIN_SIZE = 1  # connections kept open even when idle
+    PG_POOL_MAX_SIZE = 4  # upper bound of connections opened under load
+    PG_POOL_CHECK_INTERVAL = 60.0  # seconds between health checks of idle connections
+
+    def __init__(self, **settings: Any) -> None:
+        super().__init__(**settings)
+
+        self.__last_pool_check = time.monotonic()
+        self.__pool_check_lock = threading.Lock()
 
     def __get_envvars(self) -> None:
         """Get all the environment variables relevant for this processor
@@ -40,17 +59,127 @@ class StacCol2Postgres(BaseProcessor):
         self.CONN_STRING = getenv("DATA_STORAGE_ACCOUNT_CONNECTION_STRING")
         self.CONTAINER_NAME = getenv("STACCOLLECTION_STORAGE_CONTAINER_NAME")
 
+        self.PG_POOL_MIN_SIZE = int(getenv("PG_POOL_MIN_SIZE", str(self.PG_POOL_MIN_SIZE)))
+        self.PG_POOL_MAX_SIZE = int(getenv("PG_POOL_MAX_SIZE", str(self.PG_POOL_MAX_SIZE)))
+        self.PG_POOL_CHECK_INTERVAL = float(
+            getenv("PG_POOL_CHECK_INTERVAL", str(self.PG_POOL_CHECK_INTERVAL))
+        )
+
+        # insert fails for existing collections, upsert replaces them
+        self.COLLECTION_LOAD_METHOD = getenv("COLLECTION_LOAD_METHOD", "insert")
+
+        # ingest all the collections of a received batch in one transaction
+        self.BATCH_COLLECTIONS = getenv("BATCH_COLLECTIONS", "false").lower() == "true"
+
+    def __check_pool(self) -> None:
+        """Verifies the idle connections of the pool every PG_POOL_CHECK_INTERVAL
+        seconds, broken connections are replaced by new ones. Called by the worker
+        threads, only one of them runs the check and the others don't wait for it
+        :returns: None
+        :rtype: None
+        """
+
+        if time.monotonic() - self.__last_pool_check < self.PG_POOL_CHECK_INTERVAL:
+            return
+
+        if not self.__pool_check_lock.acquire(blocking=False):
+            return
+
+        try:
+            # another thread may have checked the pool since the test above
+            if time.monotonic() - self.__last_pool_check >= self.PG_POOL_CHECK_INTERVAL:
+                self.__last_pool_check = time.monotonic()
+                self.__pool.check()
+
+        finally:
+            self.__pool_check_lock.release()
+
+    def __ingest(self, urls: list[str]) -> None:
+        """Reads the STAC collections at the given URLs and ingests them to PostgreSQL
+        in a single transaction
+        :param urls: Blob URLs of the STAC collections
+        :type urls: list[str]
+        :returns: None
+        :rtype: None
+        """
+
+        import json
+
+        from azure_stac.common.__utilities import get_blob_name_from_url
+
+        # read the json files into memory
+        collections_json = self.__blob_service.gather(
+            *(
+                self.__blob_service.download_data_async(
+                    container_name=self.CONTAINER_NAME,
+                    blob_name=get_blob_name_from_url(url),
+                )
+                for url in urls
+            )
+        )
+
+        # collections deleted since their message was sent, nothing to ingest
+        for url, collection_json in zip(urls, collections_json):
+            if collection_json is None:
+                logger.warning("Skipping %s, the blob doesn't exist", url)
+
+        collections_json = [
+            collection_json
+            for collection_json in collections_json
+            if collection_json is not None
+        ]
+
+        self.__check_pool()
+
+        # commits when the block exits, rolls back if any collection fails
+        with self.__pool.connection() as conn:
+            with conn.cursor() as cursor:
+                for collection_json in collections_json:
+                    # send the json for ingestion to PostgreSQL, the statement is
+                    # prepared on the server once per pooled connection
+                    cursor.execute(
+                        COLLECTION_STATEMENTS[self.COLLECTION_LOAD_METHOD],
+                        [Jsonb(json.loads(collection_json))],
+                        prepare=True,
+                    )
+
+    def __process_message(self, msg: dict[str, Any]) -> None:
+        """Reads the STAC collection referenced by a message and ingests it
+        to PostgreSQL
+        :param msg: Decoded Event Grid message for the uploaded STAC collection
+        :type msg: dict[str, Any]
+        :returns: None
+        :rtype: None
+        """
+
+        try:
+            self.__ingest([msg["data"]["url"]])
+
+        except Exception as e:
+            raise e
+
+    def __process_batch(self, batch: list[dict[str, Any]]) -> None:
+        """Reads the STAC collections referenced by a batch of messages and ingests
+        them to PostgreSQL in a single transaction
+        :param batch: Decoded Event Grid messages for the uploaded STAC collections
+        :type batch: list[dict[str, Any]]
+        :returns: None
+        :rtype: None
+        """
+
+        try:
+            self.__ingest([msg["data"]["url"] for msg in batch])
+
+        except Exception as e:
+            raise e
+
     @sendmetrics
     def run(self, **kwargs: dict[str, Any]) -> None:
         """Ingest STAC collection to PostgreSQL"""
 
-        import asyncio
-        import json
-        import os
-
-        import psycopg
+        from psycopg_pool import ConnectionPool
 
-        from azure_stac.common.__blob_service import download_blob_async
+        from azure_stac.common.__blob_service import BlobService
 
         # call parent method to bootstrap the required metrics
         # and hooks
@@ -58,58 +187,28 @@ class StacCol2Postgres(BaseProcessor):
 
         self.__get_envvars()
 
-        # Database connector
-        conn: Optional[Connection] = None
+        if self.COLLECTION_LOAD_METHOD not in COLLECTION_STATEMENTS:
+            raise ValueError(f"Invalid collection load method: {self.COLLECTION_LOAD_METHOD}")
 
         # Construct connection string
         conn_string = "host={0} user={1} dbname={2} password={3}".format(
             self.PGHOST, self.PGUSER, self.PGDATABASE, self.PGPASSWORD
         )
-        try:
-            conn = psycopg.connect()
-        except Exception:
-            pass
-
-        for msg in self.begin_listening():
-            # Is connection closed? if so, open a new connection
-            if conn is None or conn.closed:
-                # todo: make sure to assert that kwargs has conn_string
-                # before you use it
-                conn = psycopg.connect(conn_string)
-
-            cursor = conn.cursor()
-
-            file_url = msg["data"]["url"]
-
-            try:
-                json_file = os.path.basename(file_url)
-
-                # download the json file locally
-                asyncio.run(
-                    download_blob_async(
-                        conn_str=self.CONN_STRING,
-                        container_name=self.CONTAINER_NAME,
-                        file_path=json_file,
-                        destination_path="./",
-                    )
-                )
 
-                # todo: path is different in the new solution
-                with open("./" + json_file, "r") as f:
-                    # read json from file content that was
-                    # read as string
-                    data = json.dumps(json.load(f))
-
-                    # send the json for ingestion to PostgreSQL
-                    cursor.execute("SELECT pgstac.create_collection(%s)", [data])
-
-                    conn.commit()
+        # pool of warm connections shared by all the workers
+        self.__pool = ConnectionPool(
+            conn_string, min_size=self.PG_POOL_MIN_SIZE, max_size=self.PG_POOL_MAX_SIZE
+        )
 
-                    os.remove(json_file)
+        # one blob service (event loop & connection pool) for the life of the processor
+        self.__blob_service = BlobService(conn_str=self.CONN_STRING)
 
-            except Exception as e:
-                raise e
+        with self.__pool, self.__blob_service:
+            if self.BATCH_COLLECTIONS:
+                self.process_batches(self.__process_batch)
+            else:
+                self.process_messages(self.__process_message)
 
 
-def execute_processor() -> None:
-    StacCol2Postgres().run()
+def execute_processor(**settings: Any) -> None:
+    StacCol2Postgres(**settings).run()
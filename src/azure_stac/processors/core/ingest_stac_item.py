@@ -3,17 +3,22 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-from typing import Any
+from typing import Any, Union
+
+from knack.log import get_logger
+
 from azure_stac.core.metrics import sendmetrics
 from azure_stac.core.processor import BaseProcessor
 
+logger = get_logger(__name__)
+
 
 class StacItem2Postgres(BaseProcessor):
     TEMPLATE_NAME = "Ingest STAC Item"
     VERSION = "1.0"
 
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(self, **settings: Any) -> None:
+        super().__init__(**settings)
 
     def __get_envvars(self) -> None:
         from azure_stac.common.__utilities import getenv
@@ -21,15 +26,82 @@ class StacItem2Postgres(BaseProcessor):
         self.CONNECTION_STRING = getenv("DATA_STORAGE_ACCOUNT_CONNECTION_STRING")
         self.CONTAINER_NAME = getenv("DATA_STORAGE_PGSTAC_CONTAINER_NAME")
 
+        # a batch is loaded in one transaction, with insert a single item that is
+        # already in the database fails the whole batch. Items are loaded again on
+        # the normal path, e.g. the NAIP extractor overwrites the item blobs of
+        # redelivered tiles, so the latest version of an item replaces the previous
+        self.PGSTAC_LOAD_METHOD = getenv("PGSTAC_LOAD_METHOD", "upsert")
+
+        # stream items through COPY into pgstac's staging tables, meant for backfills
+        self.PGSTAC_BULK_LOAD = getenv("PGSTAC_BULK_LOAD", "false").lower() == "true"
+
+    def __process_batch(self, batch: list[dict[str, Any]]) -> None:
+        """Reads the STAC items referenced by a batch of messages and loads them to
+        PostgreSQL
+        :param batch: Decoded Event Grid messages for the uploaded STAC items
+        :type batch: list[dict[str, Any]]
+        :returns: None
+        :rtype: None
+        """
+
+        import json
+
+        from azure_stac.common.__utilities import get_blob_name_from_url
+
+        try:
+            blobs = [
+                (get_blob_name_from_url(msg["data"]["url"]), msg["data"].get("eTag"))
+                for msg in batch
+            ]
+
+            # redelivered messages, and replays, of items that didn't change are done
+            if self.__index is not None:
+                blobs = [
+                    (name, etag) for name, etag in blobs if not self.__index.is_done(name, etag)
+                ]
+
+            if not blobs:
+                return
+
+            # the items stay in memory all the way from blob storage to the database
+            items_json = self.__blob_service.gather(
+                *(
+                    self.__blob_service.download_data_async(
+                        container_name=self.CONTAINER_NAME, blob_name=name
+                    )
+                    for name, _ in blobs
+                )
+            )
+
+            # only the blobs whose items are loaded are recorded in the index
+            loaded = []
+
+            for (name, etag), item_json in zip(blobs, items_json):
+                # the item was deleted since its message was sent, nothing to load
+                if item_json is None:
+                    logger.warning("Skipping %s, the blob doesn't exist", name)
+                    continue
+
+                self.__loader.add(json.loads(item_json))
+                loaded.append((name, etag))
+
+            # the items must be in the database before the messages are completed
+            self.__loader.flush()
+
+            if self.__index is not None:
+                self.__index.mark_many(loaded)
+
+        except Exception as e:
+            raise e
+
     @sendmetrics
     def run(self, **kwargs: dict[str, Any]) -> None:
         """Ingest STAC item to PostgreSQL"""
 
-        import asyncio
+        from contextlib import nullcontext
 
-        from azure_stac.common.__blob_service import download_blob_async
-        from azure_stac.common.__pypgstac import load_item
-        from azure_stac.common.__utilities import convert_json_to_ndjson
+        from azure_stac.common.__blob_service import BlobService
+        from azure_stac.common.__pypgstac import BulkItemLoader, ItemLoader
 
         # call parent method to bootstrap the required metrics
         # and hooks
@@ -37,26 +109,21 @@ class StacItem2Postgres(BaseProcessor):
 
         self.__get_envvars()
 
-        for msg in self.begin_listening():
-            try:
-                file_name = msg["data"]["url"]
-
-                json_file_path = asyncio.run(
-                    download_blob_async(
-                        conn_str=self.CONNECTION_STRING,
-                        container_name=self.CONTAINER_NAME,
-                        file_path=file_name,
-                        destination_path="./",
-                    )
-                )
+        # one blob service (event loop & connection pool) for the life of the processor
+        self.__blob_service = BlobService(conn_str=self.CONNECTION_STRING)
 
-                ndjson_file_path = convert_json_to_ndjson(json_file_path)
+        # one loader (database connection) for the life of the processor
+        self.__loader: Union[ItemLoader, BulkItemLoader] = (
+            BulkItemLoader(method=self.PGSTAC_LOAD_METHOD)
+            if self.PGSTAC_BULK_LOAD
+            else ItemLoader(method=self.PGSTAC_LOAD_METHOD)
+        )
 
-                load_item(ndjson_file_path)
+        self.__index = self.open_idempotency_index()
 
-            except Exception as e:
-                raise e
+        with self.__blob_service, self.__loader, self.__index or nullcontext():
+            self.process_batches(self.__process_batch)
 
 
-def execute_processor() -> None:
-    StacItem2Postgres().run()
+def execute_processor(**settings: Any) -> None:
+    StacItem2Postgres(**settings).run()
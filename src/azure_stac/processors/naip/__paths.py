@@ -0,0 +1,143 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import re
+from functools import lru_cache
+from typing import Final, Iterable, Iterator, NamedTuple, Pattern
+
+from knack.log import get_logger
+
+logger = get_logger(__name__)
+
+# layout of the NAIP COGs in the Storage Account, e.g.
+# https://storage-name.blob.core.windows.net/container/v002/wa/2015/wa_100cm_2015/45117/filename.tif
+NAIP_URL_PATTERN: Final[Pattern[str]] = re.compile(
+    r"^(?P<account_url>[^:/]+://[^/]+)/(?P<container_name>[^/]+)/"
+    r"(?P<version>[^/]+)/(?P<state>[^/]+)/(?P<year>[^/]+)/"
+    r"(?P<state_measurement_year>[^/]+)/(?P<folder_number>[^/]+)/"
+    r"(?P<stem>[^/]+)\.(?P<extension>[^./]+)$"
+)
+
+COG_EXTENSIONS = ("tif", "tiff")
+
+# number of parsed URLs kept around, messages redelivered for the same COG don't reparse it
+PATH_CACHE_SIZE = 4096
+
+
+class NaipPath:
+    """Location of a NAIP COG and of the files derived from it, all the attributes
+    are computed once when the COG URL is parsed"""
+
+    __slots__ = (
+        "cog_url",
+        "account_url",
+        "container_name",
+        "version",
+        "state",
+        "year",
+        "state_measurement_year",
+        "folder_number",
+        "file_name",
+        "stem",
+        "cog_blob_name",
+        "azure_raster_url",
+        "metadata_blob_name",
+        "metadata_url",
+        "preview_blob_name",
+        "preview_url",
+    )
+
+    def __init__(self, cog_url: str, schema: "NaipPathSchema") -> None:
+        match = NAIP_URL_PATTERN.match(cog_url)
+
+        # makes sure the file format is supported file format for this processor
+        if match is None or match["extension"] not in COG_EXTENSIONS:
+            if not cog_url.endswith(".tif") and not cog_url.endswith(".tiff"):
+                raise TypeError("Invalid file format. Only GeoTiff file formats are supported")
+            raise ValueError(f"Unexpected NAIP COG URL layout: {cog_url}")
+
+        self.cog_url = cog_url
+        self.account_url = match["account_url"]
+        self.container_name = match["container_name"]
+        self.version = match["version"]
+        self.state = match["state"]
+        self.year = match["year"]
+        self.state_measurement_year = match["state_measurement_year"]
+        self.folder_number = match["folder_number"]
+        self.stem = match["stem"]
+        self.file_name = f"{self.stem}.{match['extension']}"
+
+        # folders of the state and year, and of the COG within the container
+        year_path = f"{self.version}/{self.state}/{self.year}"
+        folder_path = f"{year_path}/{self.state_measurement_year}/{self.folder_number}"
+        container_url = f"{self.account_url}/{self.container_name}"
+
+        self.cog_blob_name = f"{folder_path}/{self.file_name}"
+
+        # az file schema URL is for use with GDAL libraries to access Storage Account
+        self.azure_raster_url = f"az://{schema.container_name}/{self.cog_blob_name}"
+
+        # FGDC metadata file, kept in a sibling folder of the state measurement year
+        self.metadata_blob_name = (
+            f"{year_path}/{self.state}_{schema.metadata_type_name}_{self.year}"
+            f"/{self.folder_number}/{self.stem}.txt"
+        )
+        self.metadata_url = f"{container_url}/{self.metadata_blob_name}"
+
+        # preview file, next to the COG
+        self.preview_blob_name = f"{folder_path}/{self.stem}.{schema.preview_extension}"
+        self.preview_url = f"{container_url}/{self.preview_blob_name}"
+
+    def __repr__(self) -> str:
+        return f"NaipPath({self.cog_url!r})"
+
+
+class NaipPathSchema(NamedTuple):
+    """Settings the locations derived from a NAIP COG URL depend on"""
+
+    # container the COGs, metadata files and previews are read from
+    container_name: str
+    # name of the metadata folders, e.g. fgdc in wa_fgdc_2015
+    metadata_type_name: str
+    # extension of the preview files, e.g. 200.jpg
+    preview_extension: str
+
+    def parse(self, cog_url: str) -> NaipPath:
+        """Parses a NAIP COG URL, the result is cached
+        :param cog_url: Full URL of the COG file uploaded to the Storage Account
+        :type cog_url: str
+        :returns: Parsed path
+        :rtype: NaipPath
+        """
+
+        return _parse(cog_url, self)
+
+    def parse_many(self, urls: Iterable[str]) -> Iterator[NaipPath]:
+        """Parses the COG URLs of a listing or of a manifest, URLs of other files
+        and of COGs that don't follow the NAIP layout are skipped. Every URL is
+        expected to be seen once so nothing is cached
+        :param urls: Full URLs of the files
+        :type urls: Iterable[str]
+        :returns: Parsed paths of the COGs
+        :rtype: Iterator[NaipPath]
+        """
+
+        for url in urls:
+            if not url.endswith(".tif") and not url.endswith(".tiff"):
+                continue
+
+            try:
+                path = NaipPath(url, self)
+
+            except ValueError as e:
+                logger.warning("Skipping %s: %s", url, e)
+                continue
+
+            yield path
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def _parse(cog_url: str, schema: NaipPathSchema) -> NaipPath:
+    return NaipPath(cog_url, schema)
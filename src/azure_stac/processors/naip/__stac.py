@@ -6,22 +6,26 @@
 import itertools
 import os
 import re
-from datetime import timedelta
-from typing import Final, Optional, Pattern
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Final, Iterable, NamedTuple, Optional, Pattern
 
 import dateutil.parser
+import numpy as np
 import pystac
 import rasterio as rio
+from pyproj import Transformer
 from pystac.extensions.eo import EOExtension
 from pystac.extensions.projection import ProjectionExtension
 from pystac.extensions.raster import DataType, RasterBand, RasterExtension
-from pystac.utils import str_to_datetime
+from pystac.utils import datetime_to_str, str_to_datetime
 from shapely.geometry import box, mapping, shape
 from stactools.core.io import read_text
 from stactools.core.projection import reproject_geom
 
 from azure_stac.common.__blob_service import generate_sas_token
 from azure_stac.common.__utilities import getenv
+from azure_stac.core.timing import span
 from azure_stac.processors.naip.__constants import STAC_BANDS, USDA_PROVIDER
 from azure_stac.processors.naip.__grid import GridExtension
 from azure_stac.processors.naip.__utils import parse_fgdc_metadata
@@ -38,11 +42,165 @@ DATA_STORAGE_ACCOUNT_KEY = getenv("DATA_STORAGE_ACCOUNT_KEY")
 DATA_STORAGE_ACCOUNT_CONNECTION_STRING = getenv("DATA_STORAGE_ACCOUNT_CONNECTION_STRING")
 COLLECTION_ID = "naip"
 
+# sections of the FGDC metadata the STAC Item is built from
+FGDC_SECTIONS = ("Identification_Information", "Distribution_Information")
+
+# GDAL settings for reading COGs straight from the Storage Account. Opening a COG
+# only fetches its TIFF header and IFDs through HTTP range requests, these settings
+# make that a single small request and keep the fetched blocks and connections
+# around for the next tile.
+# Reasoning for setting readdiri_on_open to "EMPTY_DIR":
+# https://trac.osgeo.org/gdal/wiki/ConfigOptions#GDAL_DISABLE_READDIR_ON_OPEN
+# Add CPL_CURL_VERBOSE=1 to see the curl output
+GDAL_ENV = {
+    "AZURE_NO_SIGN_REQUEST": "NO",
+    "AZURE_STORAGE_ACCOUNT_NAME": DATA_STORAGE_ACCOUNT_NAME,
+    "AZURE_STORAGE_ACCESS_KEY": DATA_STORAGE_ACCOUNT_KEY,
+    "AZURE_STORAGE_CONNECTION_STRING": DATA_STORAGE_ACCOUNT_CONNECTION_STRING,
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff",
+    # bytes fetched by the first request, enough for the header and IFDs of a NAIP COG
+    "GDAL_INGESTED_BYTES_AT_OPEN": getenv("GDAL_INGESTED_BYTES_AT_OPEN", "65536"),
+    # granularity of the range requests and of the blocks kept in the cache
+    "CPL_VSIL_CURL_CHUNK_SIZE": getenv("CPL_VSIL_CURL_CHUNK_SIZE", "65536"),
+    "CPL_VSIL_CURL_CACHE_SIZE": getenv("CPL_VSIL_CURL_CACHE_SIZE", "67108864"),
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": getenv("VSI_CACHE_SIZE", "8388608"),
+    "GDAL_HTTP_MULTIRANGE": "YES",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_VERSION": "2TLS",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+}
+
+# rasterio environment kept open for the life of each thread
+_thread_local = threading.local()
+
+
+class RasterMetadata(NamedTuple):
+    """Raster properties of a COG needed to build its STAC Item"""
+
+    gsd: float
+    epsg: int
+    shape: list[int]
+    bbox: list[float]
+    transform: list[float]
+
+
+class TileDescriptor(NamedTuple):
+    """Everything needed to build the STAC Item of a NAIP tile without any I/O"""
+
+    state: str
+    year: str
+    cog_href: str
+    cog_url: str
+    raster: RasterMetadata
+    metadata_href: Optional[str] = None
+    thumbnail_href: Optional[str] = None
+    # parsed FGDC metadata, see parse_fgdc_metadata
+    fgdc_metadata: Optional[dict[str, Any]] = None
+
+
+def ensure_gdal_env() -> None:
+    """Enters the GDAL environment for the calling thread unless it already did.
+    The environment is never exited so that its settings, and GDAL's caches,
+    are reused across tiles
+    :returns: None
+    :rtype: None
+    """
+
+    if getattr(_thread_local, "env", None) is None:
+        env = rio.Env(**GDAL_ENV)
+        env.__enter__()
+        _thread_local.env = env
+
+
+def read_raster_metadata(cog_href: str) -> RasterMetadata:
+    """Reads the raster properties of a COG. Only the TIFF header is read, no
+    pixel data is fetched
+    :param cog_href: The href to the image as a COG. This needs
+    to be an HREF that rasterio is able to open.
+    :type cog_href: str
+    :returns: Raster properties of the COG
+    :rtype: RasterMetadata
+    """
+
+    ensure_gdal_env()
+
+    with rio.open(cog_href) as ds:
+        return RasterMetadata(
+            # gsd = ground sample distance
+            gsd=round(ds.res[0], 1),
+            epsg=int(ds.crs.to_authority()[1]),
+            shape=list(ds.shape),
+            bbox=list(ds.bounds),
+            transform=list(ds.transform),
+        )
+
 
 def get_metadata_sas_url(href: str) -> str:
     return str(f"{href}?{generate_sas_token(conn_str=DATA_STORAGE_ACCOUNT_CONNECTION_STRING)}")
 
 
+def get_item_id(state: str, cog_href: str, stac_metadata: dict[str, Any]) -> str:
+    """Builds the id of the STAC Item of a tile
+    :param state: The 2-letter state code of the tile
+    :type state: str
+    :param cog_href: The href to the image as a COG
+    :type cog_href: str
+    :param stac_metadata: Parsed FGDC metadata of the tile, may be empty
+    :type stac_metadata: dict[str, Any]
+    :returns: Item id
+    :rtype: str
+    """
+
+    if "Distribution_Information" in stac_metadata:
+        resource_desc = stac_metadata["Distribution_Information"]["Resource_Description"]
+    else:
+        resource_desc = os.path.basename(cog_href)
+
+    return "{}_{}".format(state, os.path.splitext(resource_desc)[0])
+
+
+def get_item_datetime(cog_href: str, stac_metadata: dict[str, Any]) -> datetime:
+    """Gets the acquisition datetime of a tile from its FGDC metadata, or from
+    its file name when there is no metadata
+    :param cog_href: The href to the image as a COG
+    :type cog_href: str
+    :param stac_metadata: Parsed FGDC metadata of the tile, may be empty
+    :type stac_metadata: dict[str, Any]
+    :returns: Acquisition datetime
+    :rtype: datetime
+    """
+
+    if any(stac_metadata):
+        dt = str_to_datetime(
+            stac_metadata["Identification_Information"]["Time_Period_of_Content"][
+                "Time_Period_Information"
+            ]["Single_Date/Time"]["Calendar_Date"]
+        )
+    else:
+        fname = os.path.splitext(os.path.basename(cog_href))[0]
+        fname_date = fname.split("_")[5]
+        dt = dateutil.parser.isoparse(fname_date)
+
+    # UTC is +4 ET, so is around 9-12 AM in CONUS
+    return dt + timedelta(hours=16)
+
+
+def get_grid_code(item_id: str) -> Optional[str]:
+    """Gets the Digital Orthophoto Quarter Quadrangle grid code of an item
+    :param item_id: Item id
+    :type item_id: str
+    :returns: Grid code, None when the id doesn't follow the NAIP naming
+    :rtype: Optional[str]
+    """
+
+    if match := DOQQ_PATTERN.search(item_id):
+        return f"DOQQ-{match.group(1)}{match.group(2).upper()}"
+
+    return None
+
+
 def create_item(
     state: str,
     year: str,
@@ -51,6 +209,7 @@ def create_item(
     thumbnail_href: Optional[str] = None,
     additional_providers: Optional[list[pystac.Provider]] = None,
     cog_url: Optional[str] = None,
+    metadata_text: Optional[str] = None,
 ) -> pystac.Item:
     """Creates a STAC Item. This function will read the metadata file for information
     to place in the STAC item.
@@ -60,6 +219,9 @@ def create_item(
     :type year: str
     :param metadata_href: The href to the metadata
     :type metadata_href: str
+    :param metadata_text: Optional content of the metadata file, when the caller
+    already fetched it. The file is read from metadata_href otherwise.
+    :type metadata_text: str
     :param cog_href: The href to the image as a COG. This needs
     to be an HREF that rasterio is able to open.
     :type cog_href: str
@@ -72,62 +234,37 @@ def create_item(
     :rtype: pystac.Item
     """
 
-    # Reasoning for setting readdiri_on_open to "EMPTY_DIR":
-    # https://trac.osgeo.org/gdal/wiki/ConfigOptions#GDAL_DISABLE_READDIR_ON_OPEN
-    # Uncomment CPL_CURL_VERBOSE=1 to see the curl output
-    gdal_env = {
-        "AZURE_NO_SIGN_REQUEST": "NO",
-        "AZURE_STORAGE_ACCOUNT_NAME": DATA_STORAGE_ACCOUNT_NAME,
-        "AZURE_STORAGE_ACCESS_KEY": DATA_STORAGE_ACCOUNT_KEY,
-        "AZURE_STORAGE_CONNECTION_STRING": DATA_STORAGE_ACCOUNT_CONNECTION_STRING,
-        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
-    }
-
     try:
         try:
-            with rio.Env(**gdal_env):
-                with rio.open(cog_href) as ds:
-                    # gsd = ground sample distance
-                    gsd = round(ds.res[0], 1)
-                    epsg = int(ds.crs.to_authority()[1])
-                    image_shape = list(ds.shape)
-                    original_bbox = list(ds.bounds)
-                    transform = list(ds.transform)
-                    geom = reproject_geom(
-                        ds.crs, "epsg:4326", mapping(box(*ds.bounds)), precision=6
-                    )
+            with span("naip.read_raster"):
+                raster = read_raster_metadata(cog_href)
 
         except rio.errors.RasterioIOError as err:
             raise err
 
-        if metadata_href is not None:
-            stac_metadata_text = read_text(metadata_href, get_metadata_sas_url)
-            stac_metadata = parse_fgdc_metadata(stac_metadata_text)
-        else:
-            stac_metadata = {}
+        gsd = raster.gsd
+        epsg = raster.epsg
+        image_shape = raster.shape
+        original_bbox = raster.bbox
+        transform = raster.transform
+        geom = reproject_geom(
+            f"EPSG:{epsg}", "epsg:4326", mapping(box(*original_bbox)), precision=6
+        )
 
-        if "Distribution_Information" in stac_metadata:
-            resource_desc = stac_metadata["Distribution_Information"]["Resource_Description"]
+        if metadata_text is not None:
+            with span("naip.parse_fgdc"):
+                stac_metadata = parse_fgdc_metadata(metadata_text, sections=FGDC_SECTIONS)
+        elif metadata_href is not None:
+            with span("naip.fetch_metadata"):
+                stac_metadata_text = read_text(metadata_href, get_metadata_sas_url)
+            with span("naip.parse_fgdc"):
+                stac_metadata = parse_fgdc_metadata(stac_metadata_text, sections=FGDC_SECTIONS)
         else:
-            resource_desc = os.path.basename(cog_href)
-
-        item_id = "{}_{}".format(state, os.path.splitext(resource_desc)[0])
+            stac_metadata = {}
 
+        item_id = get_item_id(state, cog_href, stac_metadata)
         bounds = list(shape(geom).bounds)
-
-        if any(stac_metadata):
-            dt = str_to_datetime(
-                stac_metadata["Identification_Information"]["Time_Period_of_Content"][
-                    "Time_Period_Information"
-                ]["Single_Date/Time"]["Calendar_Date"]
-            )
-        else:
-            fname = os.path.splitext(os.path.basename(cog_href))[0]
-            fname_date = fname.split("_")[5]
-            dt = dateutil.parser.isoparse(fname_date)
-
-        # UTC is +4 ET, so is around 9-12 AM in CONUS
-        dt = dt + timedelta(hours=16)
+        dt = get_item_datetime(cog_href, stac_metadata)
         properties = {f"{COLLECTION_ID}:state": state, f"{COLLECTION_ID}:year": year}
 
         item = pystac.Item(
@@ -157,8 +294,8 @@ def create_item(
 
         # Grid Extension
         grid = GridExtension.ext(item, add_if_missing=True)
-        if match := DOQQ_PATTERN.search(item_id):
-            grid.code = f"DOQQ-{match.group(1)}{match.group(2).upper()}"
+        if grid_code := get_grid_code(item_id):
+            grid.code = grid_code
 
         # COG
         if cog_url:
@@ -221,3 +358,228 @@ def create_item(
 
     except Exception as e:
         raise e
+
+
+def describe_tile(
+    state: str,
+    year: str,
+    cog_href: str,
+    cog_url: str,
+    metadata_href: Optional[str] = None,
+    metadata_text: Optional[str] = None,
+    thumbnail_href: Optional[str] = None,
+) -> TileDescriptor:
+    """Reads what create_items needs to build the STAC Item of a tile: the raster
+    properties of its COG and its parsed FGDC metadata
+    :param state: The 2-letter state code for the state this tile belongs to.
+    :type state: str
+    :param year: year.
+    :type year: str
+    :param cog_href: The href to the image as a COG. This needs
+    to be an HREF that rasterio is able to open.
+    :type cog_href: str
+    :param cog_url: URL of the COG the image asset links to
+    :type cog_url: str
+    :param metadata_href: Optional href to the metadata file of the tile
+    :type metadata_href: str
+    :param metadata_text: Optional content of the metadata file of the tile
+    :type metadata_text: str
+    :param thumbnail_href: Optional href for a thumbnail for this tile.
+    :type thumbnail_href: str
+    :returns: The tile
+    :rtype: TileDescriptor
+    """
+
+    with span("naip.read_raster"):
+        raster = read_raster_metadata(cog_href)
+
+    fgdc_metadata = None
+    if metadata_text is not None:
+        with span("naip.parse_fgdc"):
+            fgdc_metadata = parse_fgdc_metadata(metadata_text, sections=FGDC_SECTIONS)
+
+    return TileDescriptor(
+        state=state,
+        year=year,
+        cog_href=cog_href,
+        cog_url=cog_url,
+        raster=raster,
+        metadata_href=metadata_href,
+        thumbnail_href=thumbnail_href,
+        fgdc_metadata=fgdc_metadata,
+    )
+
+
+def _get_transformer(epsg: int) -> Transformer:
+    """Gets the transformer from a UTM zone to WGS84, transformers are costly to
+    create so they are kept for the life of each thread
+    :param epsg: EPSG code of the source CRS
+    :type epsg: int
+    :returns: Transformer
+    :rtype: Transformer
+    """
+
+    transformers = getattr(_thread_local, "transformers", None)
+    if transformers is None:
+        transformers = _thread_local.transformers = {}
+
+    if epsg not in transformers:
+        transformers[epsg] = Transformer.from_crs(epsg, 4326, always_xy=True)
+
+    return transformers[epsg]
+
+
+def _reproject_footprints(tiles: list[TileDescriptor]) -> list[list[list[float]]]:
+    """Reprojects the bounding boxes of tiles to WGS84 polygon rings. The tiles are
+    grouped by CRS and all the corners of a group go through the transformer in
+    one call
+    :param tiles: Tiles
+    :type tiles: list[TileDescriptor]
+    :returns: Closed ring of each tile, in the same order as the tiles
+    :rtype: list[list[list[float]]]
+    """
+
+    rings: list[list[list[float]]] = [[] for _ in tiles]
+    groups: dict[int, list[int]] = {}
+    for index, tile in enumerate(tiles):
+        groups.setdefault(tile.raster.epsg, []).append(index)
+
+    for epsg, indexes in groups.items():
+        bboxes = np.array([tiles[index].raster.bbox for index in indexes], dtype=np.float64)
+        minx, miny, maxx, maxy = bboxes.T
+
+        # same corner order as shapely's box, counter clockwise from the lower right
+        xs = np.stack([maxx, maxx, minx, minx], axis=1)
+        ys = np.stack([miny, maxy, maxy, miny], axis=1)
+        lons, lats = _get_transformer(epsg).transform(xs, ys, errcheck=True)
+        corners = np.round(np.stack([lons, lats], axis=2), 6).tolist()
+
+        for index, ring in zip(indexes, corners):
+            rings[index] = ring + [ring[0]]
+
+    return rings
+
+
+def create_items(
+    tiles: Iterable[TileDescriptor],
+    additional_providers: Optional[list[pystac.Provider]] = None,
+    self_href_base: Optional[str] = None,
+) -> list[dict[str, Any]]:
+    """Creates the STAC Items of many tiles at once, as dictionaries. Produces the
+    same items as create_item, without reading anything and without building
+    pystac objects. The footprints of all the tiles are reprojected together and
+    the providers, bands and extensions are only built once and shared by all the
+    items, so they must not be modified in place.
+    :param tiles: Tiles to create the items of
+    :type tiles: Iterable[TileDescriptor]
+    :param additional_providers: Optional list of additional
+    providers to the USDA that will be included on the Items.
+    :type additional_providers: List[pystac.Provider]
+    :param self_href_base: Optional base URL of the self link of the items,
+    the link is {self_href_base}/{item id}.json
+    :type self_href_base: str
+    :returns: STAC Items
+    :rtype: list[dict[str, Any]]
+    """
+
+    tiles = list(tiles)
+    rings = _reproject_footprints(tiles)
+
+    providers = [USDA_PROVIDER.to_dict()]
+    if additional_providers is not None:
+        providers.extend(provider.to_dict() for provider in additional_providers)
+
+    stac_extensions = [
+        EOExtension.get_schema_uri(),
+        ProjectionExtension.get_schema_uri(),
+        GridExtension.get_schema_uri(),
+        RasterExtension.get_schema_uri(),
+    ]
+    eo_bands = [band.to_dict() for band in STAC_BANDS]
+    raster_bands: dict[float, list[dict[str, Any]]] = {}
+
+    items = []
+    for tile, ring in zip(tiles, rings):
+        stac_metadata = tile.fgdc_metadata or {}
+        raster = tile.raster
+        item_id = get_item_id(tile.state, tile.cog_href, stac_metadata)
+
+        if raster.gsd not in raster_bands:
+            band = RasterBand.create(
+                nodata=0, spatial_resolution=raster.gsd, data_type=DataType.UINT8, unit="none"
+            ).to_dict()
+            raster_bands[raster.gsd] = [band] * 4
+
+        properties: dict[str, Any] = {
+            f"{COLLECTION_ID}:state": tile.state,
+            f"{COLLECTION_ID}:year": tile.year,
+            "providers": providers,
+            "gsd": raster.gsd,
+            "proj:epsg": raster.epsg,
+            "proj:shape": raster.shape,
+            "proj:bbox": raster.bbox,
+            "proj:transform": raster.transform,
+        }
+        if grid_code := get_grid_code(item_id):
+            properties["grid:code"] = grid_code
+        properties["datetime"] = datetime_to_str(
+            get_item_datetime(tile.cog_href, stac_metadata)
+        )
+
+        assets: dict[str, Any] = {
+            "image": {
+                "href": tile.cog_url,
+                "type": pystac.MediaType.COG,
+                "title": "RGBIR COG tile",
+                "eo:bands": eo_bands,
+                "raster:bands": raster_bands[raster.gsd],
+                "roles": ["data"],
+            }
+        }
+        if any(stac_metadata) and tile.metadata_href is not None:
+            assets["metadata"] = {
+                "href": tile.metadata_href,
+                "type": pystac.MediaType.TEXT,
+                "title": "FGDC Metadata",
+                "roles": ["metadata"],
+            }
+        if tile.thumbnail_href is not None:
+            media_type = pystac.MediaType.JPEG
+            if tile.thumbnail_href.lower().endswith("png"):
+                media_type = pystac.MediaType.PNG
+            assets["thumbnail"] = {
+                "href": tile.thumbnail_href,
+                "type": media_type,
+                "title": "Thumbnail",
+                "roles": ["thumbnail"],
+            }
+
+        links = []
+        if self_href_base is not None:
+            links.append(
+                {
+                    "rel": "self",
+                    "href": f"{self_href_base}/{item_id}.json",
+                    "type": pystac.MediaType.JSON,
+                }
+            )
+
+        lons = [corner[0] for corner in ring]
+        lats = [corner[1] for corner in ring]
+
+        items.append(
+            {
+                "type": "Feature",
+                "stac_version": pystac.get_stac_version(),
+                "id": item_id,
+                "properties": properties,
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+                "links": links,
+                "assets": assets,
+                "bbox": [min(lons), min(lats), max(lons), max(lats)],
+                "stac_extensions": stac_extensions,
+                "collection": COLLECTION_ID,
+            }
+        )
+
+    return items
@@ -0,0 +1,66 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import warnings
+from typing import Sequence
+
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import MemoryFile
+
+from azure_stac.processors.naip.__stac import ensure_gdal_env
+
+# NAIP tiles are Red, Green, Blue, NIR
+RGB_BANDS = (1, 2, 3)
+
+
+def create_thumbnail(
+    cog_href: str,
+    size: int = 512,
+    bands: Sequence[int] = RGB_BANDS,
+    driver: str = "JPEG",
+) -> bytes:
+    """Creates a thumbnail of a COG in memory. The pixels are read at the thumbnail's
+    resolution, which lets GDAL serve them from the closest internal overview of the
+    COG instead of the full resolution image
+    :param cog_href: The href to the image as a COG. This needs
+    to be an HREF that rasterio is able to open.
+    :type cog_href: str
+    :param size: Size of the longest side of the thumbnail, in pixels. Images
+        smaller than this are not upscaled
+    :type size: int
+    :param bands: Indexes of the bands to render, in order
+    :type bands: Sequence[int]
+    :param driver: GDAL driver used to encode the thumbnail, JPEG or PNG
+    :type driver: str
+    :returns: Encoded thumbnail
+    :rtype: bytes
+    """
+
+    ensure_gdal_env()
+
+    with rio.open(cog_href) as ds:
+        scale = min(1.0, size / max(ds.width, ds.height))
+        width = max(1, round(ds.width * scale))
+        height = max(1, round(ds.height * scale))
+
+        data = ds.read(
+            indexes=list(bands),
+            out_shape=(len(bands), height, width),
+            resampling=Resampling.average,
+        )
+
+    with warnings.catch_warnings():
+        # the thumbnail is intentionally written without georeferencing
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+
+        with MemoryFile() as memfile:
+            with memfile.open(
+                driver=driver, width=width, height=height, count=len(bands), dtype="uint8"
+            ) as dst:
+                dst.write(data.astype("uint8", copy=False))
+
+            return bytes(memfile.read())
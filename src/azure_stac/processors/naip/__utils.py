@@ -3,81 +3,100 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-import re
-from typing import Any, Optional
+from typing import Any, Iterable, Optional
 
 
-def parse_fgdc_metadata(md_text: str) -> Any:
+def parse_fgdc_metadata(md_text: str, sections: Optional[Iterable[str]] = None) -> Any:
     """Parses FGDC metadata. FGDC is a structure specific to NAIP data source.
+    The text is parsed in a single pass over its lines, nested groups are
+    identified by their indentation.
     :param md_text: Markdown text
     :type md_text: str
+    :param sections: Optional names of the top level sections (e.g.
+        Identification_Information) to parse, all other sections are skipped
+        without being parsed. Defaults to all the sections
+    :type sections: Iterable[str]
     :returns: metadata
     :rtype: any
     """
 
-    line_pattern = r"([\s]*)([^:]+)*(\:?)[\s]*(.*)"
+    # Replace tabs with 4 spaces, splitlines takes care of stray carriage returns
+    lines = md_text.replace("\t", "    ").splitlines()
+    line_count = len(lines)
+    wanted = frozenset(sections) if sections is not None else None
 
-    def _parse(lines: list[str], group_indent: int = 0) -> Any:
+    # index of the next line to parse, shared by all the nested groups
+    index = 0
+
+    def _indent(line: str) -> int:
+        return len(line) - len(line.lstrip())
+
+    def _skip(group_indent: int) -> None:
+        """Moves past all the lines of a group without parsing them
+        :param group_indent: Indentation of the lines of the group
+        :type group_indent: int
+        """
+        nonlocal index
+
+        while index < line_count:
+            line = lines[index]
+
+            if line.strip() and _indent(line) < group_indent:
+                break
+
+            index += 1
+
+    def _parse(group_indent: int = 0) -> Any:
         """Parse FGDC data
-        :param lines: lines
-        :type lines: str
         :param group_indent: Defaults to 0.
         :type group_indent: int
         :returns: metadata
         :rtype: any
         """
+        nonlocal index
+
         result = {}
-        is_multiline_text = False
-        result_text = None  # type: Optional[str]
-        while len(lines) > 0:
-            # Peek at the next line to see if we're done this group
-            line = lines[0]
-            # Replace stray carriage returns
-            line = line.replace("^M", "")
-            # Replace tabs with 4 spaces
-            line = line.replace("\t", "    ")
-
-            if not line.strip():
-                lines.pop(0)
-                continue
+        text: Optional[list[str]] = None
 
-            m = re.search(line_pattern, line)
-            if not m:
-                raise Exception("Could not parses line:\n{}\n".format(line))
+        while index < line_count:
+            # Peek at the next line to see if we're done this group
+            line = lines[index]
+            stripped = line.strip()
 
-            this_indent = len(m.group(1))
+            if not stripped:
+                index += 1
+                continue
 
-            if this_indent < group_indent:
+            if _indent(line) < group_indent:
                 break
 
-            # Remove this line from the top of the stack and
-            # process it.
-
-            lines.pop(0)
+            # Consume this line and process it.
+            index += 1
 
             # If we're collecting multi-line text values,
             # just add the line to the result text.
-            if is_multiline_text:
-                prev_result = " {result_text}" if result_text is not None else ""
-                result_text = f"{prev_result}{line.strip()}"
+            if text is not None:
+                text.append(stripped)
                 continue
 
-            this_key = m.group(2)
-            key_flag = m.group(3) != "" and " " not in this_key
-            this_value = m.group(4)
+            this_key, colon, this_value = stripped.partition(":")
+            key_flag = colon != "" and this_key != "" and " " not in this_key
+            this_value = this_value.strip()
 
             if key_flag and this_value != "":
-                result[this_key] = this_value.strip()
-            else:
-                if key_flag:
-                    result[this_key] = _parse(lines, group_indent + 2)
+                result[this_key] = this_value
+            elif key_flag:
+                # sections are the groups right under the root Metadata group
+                if wanted is not None and group_indent == 2 and this_key not in wanted:
+                    _skip(group_indent + 2)
                 else:
-                    is_multiline_text = True
-                    result_text = line.strip()
+                    result[this_key] = _parse(group_indent + 2)
+            else:
+                text = [stripped]
 
-        if is_multiline_text:
-            return result_text
+        if text is not None:
+            return " ".join(text)
         else:
             return result
 
-    return _parse(md_text.split("\n"), group_indent=0)["Metadata"]
+    return _parse(group_indent=0)["Metadata"]
@@ -4,28 +4,38 @@
 # --------------------------------------------------------------------------------------------
 
 import json
-import os
-import traceback
+from contextlib import nullcontext
 from typing import Any, Optional, Tuple
 
-from osgeo import gdal
-
 import pystac
+from knack.log import get_logger
 
+from azure_stac.common.__blob_service import BlobService, read_blob_inventory
 from azure_stac.common.__utilities import getenv
 from azure_stac.core.metrics import sendmetrics
 from azure_stac.core.processor import BaseProcessor
-from azure_stac.processors.naip.__stac import create_item
+from azure_stac.core.timing import span
+from azure_stac.processors.naip.__paths import NaipPath, NaipPathSchema
+from azure_stac.processors.naip.__stac import (
+    TileDescriptor,
+    create_item,
+    create_items,
+    describe_tile,
+)
+from azure_stac.processors.naip.__thumbnail import create_thumbnail
+
+logger = get_logger(__name__)
 
 
 class ExtractStac4mNaip(BaseProcessor):
     TEMPLATE_NAME = "Extract STAC From NAIP"
     VERSION = "1.0"
 
-    LOCAL_FILE_PATH = "./"
+    THUMBNAIL_SIZE = 512  # longest side of the generated previews, in pixels
+    BACKFILL_BATCH_SIZE = 100  # number of tiles the backfill builds the items of at once
 
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(self, **settings: Any) -> None:
+        super().__init__(**settings)
         self.__get_envvars()
 
     def __get_envvars(self) -> None:
@@ -35,14 +45,29 @@ class ExtractStac4mNaip(BaseProcessor):
         """
 
         self.JPG_EXTENSION = getenv("JPG_EXTENSION")
-        self.XML_EXTENSION = getenv("XML_EXTENSION")
+        self.THUMBNAIL_SIZE = int(getenv("THUMBNAIL_SIZE", str(self.THUMBNAIL_SIZE)))
+        self.BACKFILL_BATCH_SIZE = int(
+            getenv("BACKFILL_BATCH_SIZE", str(self.BACKFILL_BATCH_SIZE))
+        )
         self.DST_CONTAINER_NAME = getenv("DATA_STORAGE_PGSTAC_CONTAINER_NAME")
         self.SRC_CONTAINER_NAME = getenv("STACIFY_STORAGE_CONTAINER_NAME")
         self.STAC_METADATA_TYPE_NAME = getenv("STAC_METADATA_TYPE_NAME")
         self.CONNECTION_STRING = getenv("DATA_STORAGE_ACCOUNT_CONNECTION_STRING")
         self.STORAGE_ACCOUNT_NAME = getenv("DATA_STORAGE_ACCOUNT_NAME")
 
-    def __create_item_in_blob(
+        # base URL of the self links of the items
+        self.__items_url = (
+            f"https://{self.STORAGE_ACCOUNT_NAME}.blob.core.windows.net"
+            f"/{self.DST_CONTAINER_NAME}"
+        )
+
+        self.__paths = NaipPathSchema(
+            container_name=self.SRC_CONTAINER_NAME,
+            metadata_type_name=self.STAC_METADATA_TYPE_NAME,
+            preview_extension=self.JPG_EXTENSION,
+        )
+
+    def __create_item(
         self,
         state: str,
         year: str,
@@ -52,14 +77,16 @@ class ExtractStac4mNaip(BaseProcessor):
         providers: Optional[str],
         cog_url: str,
         stac_metadata: Optional[str] = None,
-    ) -> str:
+        stac_metadata_text: Optional[str] = None,
+    ) -> pystac.Item:
         """Creates a STAC Item based on metadata.
 
         STATE is the state this NAIP tile belongs to.
         COG_HREF is the href to the COG that is the NAIP tile.
         FGDC_HREF is href to the text metadata file in the NAIP fgdc format.
-        DST is directory that a STAC Item JSON file will be created
-        in.
+        FGDC_TEXT is the content of that file, when it was already fetched.
+        DST is the blob store location the STAC Item JSON file will be
+        uploaded to.
         """
         additional_providers = None
 
@@ -72,251 +99,383 @@ class ExtractStac4mNaip(BaseProcessor):
             year,
             cog_href,
             metadata_href=stac_metadata,
+            metadata_text=stac_metadata_text,
             thumbnail_href=thumbnail,
             additional_providers=additional_providers,
             cog_url=cog_url,
         )
-        # join to local path
-        item_path = os.path.join(self.LOCAL_FILE_PATH, "{}.json".format(item.id))
-
         # save blob store self link
         item.set_self_href(f"{dst}/{item.id}.json")
 
-        # save to local file system
-        item.save_object(dest_href=item_path)
+        return item
 
-        return item.id
+    def __process_message(self, msg: dict[str, Any]) -> None:
+        """Generates the preview and the STAC Item for the COG referenced by a message
+        :param msg: Decoded Event Grid message for the uploaded COG
+        :type msg: dict[str, Any]
+        :returns: None
+        :rtype: None
+        """
 
-    def __translate_tif_to_jpeg(self, title: str, tif_file: str) -> None:
-        """Translates a TIFF file to a JPEG file.
-        :param title: Name of the translated output JPEG
-        :type title: str
-        :param tif_file: Name of the GeoTiff to translate
-        :type tif_file: str
+        # every location derived from the COG URL, parsed once
+        path = self.__paths.parse(msg["data"]["url"])
+        etag = msg["data"].get("eTag")
+
+        # redelivered messages, and replays, of a COG that didn't change are done
+        if self.__index is not None and self.__index.is_done(path.cog_blob_name, etag):
+            logger.info("Skipping %s, already processed", path.cog_url)
+            return
+
+        # fetch the metadata file, None when there's none, and check if the jpeg
+        # (preview) exists, both at once
+        with span("naip.fetch_sidecars"):
+            metadata, does_jpeg_file_exist = self.__blob_service.gather(
+                self.__blob_service.download_data_async(
+                    container_name=self.SRC_CONTAINER_NAME, blob_name=path.metadata_blob_name
+                ),
+                self.__blob_service.check_if_blob_exists(
+                    container_name=self.SRC_CONTAINER_NAME, blob_name=path.preview_blob_name
+                ),
+            )
+
+        self.__process_tile(path, etag, metadata, does_jpeg_file_exist)
+
+    def __ensure_preview(self, path: NaipPath, does_jpeg_file_exist: bool) -> None:
+        """Generates the preview of a COG and uploads it next to the COG, unless it
+        already has one
+        :param path: Parsed path of the COG
+        :type path: NaipPath
+        :param does_jpeg_file_exist: Whether the COG already has a preview
+        :type does_jpeg_file_exist: bool
         :returns: None
         :rtype: None
         """
-        option_list = [
-            "-ot byte",
-            "-of JPEG",
-            "-outsize 100% 100%",
-        ]
 
-        option_string = " ".join(option_list)
+        if does_jpeg_file_exist:
+            return
+
+        # render the preview from the COG's overviews, in memory
+        is_png = self.JPG_EXTENSION.lower().endswith("png")
+
+        with span("naip.thumbnail"):
+            thumbnail = create_thumbnail(
+                path.azure_raster_url,
+                size=self.THUMBNAIL_SIZE,
+                driver="PNG" if is_png else "JPEG",
+            )
+
+        # upload the preview next to the COG
+        with span("naip.upload_preview"):
+            self.__blob_service.run(
+                self.__blob_service.upload_data_async(
+                    container_name=self.SRC_CONTAINER_NAME,
+                    blob_name=path.preview_blob_name,
+                    data=thumbnail,
+                    overwrite=True,
+                    content_type="image/png" if is_png else "image/jpeg",
+                )
+            )
+
+    def __describe_listed_tile(
+        self, path: NaipPath, does_metadata_file_exist: bool, does_jpeg_file_exist: bool
+    ) -> TileDescriptor:
+        """Generates the preview, when missing, of a COG whose sidecar files are
+        known from a listing and reads what its STAC Item is built from, see
+        create_items
+        :param path: Parsed path of the COG
+        :type path: NaipPath
+        :param does_metadata_file_exist: Whether the COG has an FGDC metadata file
+        :type does_metadata_file_exist: bool
+        :param does_jpeg_file_exist: Whether the COG already has a preview
+        :type does_jpeg_file_exist: bool
+        :returns: The tile
+        :rtype: TileDescriptor
+        """
+
+        metadata = None
 
-        try:
-            # generate jpeg and aux.xml for COG
-            gdal.Translate(f"{title}.{self.JPG_EXTENSION}", tif_file, options=option_string)
-        except Exception as err:
-            raise err
-
-    def __get_url_variations(self, cog_url: str) -> Tuple[list[str], str, list[str], str]:
-        """Gets variations of the COG URL to provide the required absolute &
-        relative URLs and/or paths required for constructing the various source
-        and destination locations for raster data, it's metadata and other supporting
-        files.
-        :param cog_url: Full URL of the COG file uploaded to the Storage Account
-        :type cog_url: str
-        :returns: Attributes version, state, year, state measurement year
-            and folder number (in the order)
-        :rtype: Tuple[str, str, str, str]
+        if does_metadata_file_exist:
+            with span("naip.fetch_sidecars"):
+                metadata = self.__blob_service.run(
+                    self.__blob_service.download_data_async(
+                        container_name=self.SRC_CONTAINER_NAME,
+                        blob_name=path.metadata_blob_name,
+                    )
+                )
+
+        self.__ensure_preview(path, does_jpeg_file_exist)
+
+        return describe_tile(
+            state=path.state,
+            year=path.year,
+            cog_href=path.azure_raster_url,
+            cog_url=path.cog_url,
+            metadata_href=path.metadata_url if metadata is not None else None,
+            metadata_text=(
+                metadata.decode("utf-8", errors="replace") if metadata is not None else None
+            ),
+            thumbnail_href=path.preview_url,
+        )
+
+    def __publish_tiles(
+        self, tiles: list[Tuple[NaipPath, Optional[str], TileDescriptor]]
+    ) -> int:
+        """Builds the STAC Items of tiles at once, uploads them and records the COGs
+        in the idempotency index
+        :param tiles: Parsed path, ETag and descriptor of every tile
+        :type tiles: list[Tuple[NaipPath, Optional[str], TileDescriptor]]
+        :returns: Number of tiles whose item failed to be built or uploaded
+        :rtype: int
         """
 
-        import os
+        try:
+            with span("naip.create_items"):
+                items = create_items(
+                    (tile for _, _, tile in tiles), self_href_base=self.__items_url
+                )
 
-        split_url = os.path.dirname(cog_url).split("/")
+        except Exception as e:
+            logger.error("Failed to create the items of %d tiles", len(tiles), exc_info=e)
+            return len(tiles)
 
-        domain_path = split_url[0:4]
+        async def upload_item(item: dict[str, Any]) -> Optional[Exception]:
+            # a failed upload only fails its own tile
+            try:
+                await self.__blob_service.upload_data_async(
+                    container_name=self.DST_CONTAINER_NAME,
+                    blob_name=f"{item['id']}.json",
+                    data=json.dumps(item).encode(),
+                    overwrite=True,
+                    content_type="application/json",
+                )
+
+            except Exception as e:
+                return e
+
+            return None
 
-        domain_path_joined = "/".join(domain_path)
+        with span("naip.upload_items"):
+            errors = self.__blob_service.gather(*(upload_item(item) for item in items))
 
-        split_url_joined = "/".join(split_url[4:7])
+        uploaded = []
+        for (path, etag, _), error in zip(tiles, errors):
+            if error is None:
+                uploaded.append((path.cog_blob_name, etag))
+            else:
+                logger.error("Failed to upload the item of %s", path.cog_url, exc_info=error)
 
-        return split_url, split_url_joined, domain_path, domain_path_joined
+        if self.__index is not None:
+            self.__index.mark_many(uploaded)
 
-    def __parse_url_based_attributes(self, url: list[str]) -> Tuple[str, str, str, str, str]:
-        """Parses key attributes including (but not limited to) version, state, year from
-        url path where the raster data is being downloaded from
-        :param url: URL of the raster data to be downloaded
-        :type url: str
-        :returns: Attributes version, state, year, state measurement year
-            and folder number (in the order)
-        :rtype: Tuple[str, str, str, str, str]
+        return len(tiles) - len(uploaded)
+
+    def __process_tile(
+        self,
+        path: NaipPath,
+        etag: Optional[str],
+        metadata: Optional[bytes],
+        does_jpeg_file_exist: bool,
+    ) -> None:
+        """Generates the preview, when missing, and the STAC Item of a COG, then
+        records the COG in the idempotency index
+        :param path: Parsed path of the COG
+        :type path: NaipPath
+        :param etag: ETag of the COG, if known
+        :type etag: str
+        :param metadata: Content of the FGDC metadata file of the COG, if it has one
+        :type metadata: bytes
+        :param does_jpeg_file_exist: Whether the COG already has a preview
+        :type does_jpeg_file_exist: bool
+        :returns: None
+        :rtype: None
         """
 
-        # retrieve attributes from folder path. folder path is expected
-        # to be in the format:
-        # https://storage-name.blob.core.azure.com/container/v002/wa/2015/wa_100cm_2015/45117/filename.ext
-        # all indexes are zero-index based
-        version = url[4]
-        state = url[5]
-        year = url[6]
-        state_measurement_year = url[7]
-        folder_number = url[8]
+        try:
+            # checks if the jpeg file exists (jpeg files are preview files for
+            # the bigger raster data) and intended to be served as one of the
+            # assets for the STAC Item
+            self.__ensure_preview(path, does_jpeg_file_exist)
+
+            # if the metada file does not exists, we need to generate the
+            # necessary metadata before generating the STAC Item json file
+            # which will be ingested into the PostgreSQL database
+            # ------------ or ------------
+            # if the metadata file exists, the process to generate the
+            # STAC Item json file is relatively simple. Minimal metadata
+            # is generated from the raster data and then merge with the
+            # metadata provided in the metada file to generate the STAC
+            # item which will be ingested in the PostgreSQL database
+            with span("naip.create_item"):
+                item = self.__create_item(
+                    state=path.state,
+                    year=path.year,
+                    cog_href=path.azure_raster_url,
+                    dst=self.__items_url,
+                    stac_metadata=path.metadata_url if metadata is not None else None,
+                    stac_metadata_text=(
+                        metadata.decode("utf-8", errors="replace")
+                        if metadata is not None
+                        else None
+                    ),
+                    thumbnail=path.preview_url,
+                    providers=None,
+                    cog_url=path.cog_url,
+                )
+
+            # upload stac item to blob straight from memory, it is serialised only once
+            with span("naip.serialize_item"):
+                data = json.dumps(item.to_dict()).encode()
 
-        return version, state, year, state_measurement_year, folder_number
+            with span("naip.upload_item"):
+                self.__blob_service.run(
+                    self.__blob_service.upload_data_async(
+                        container_name=self.DST_CONTAINER_NAME,
+                        blob_name=f"{item.id}.json",
+                        data=data,
+                        overwrite=True,
+                        content_type="application/json",
+                    )
+                )
+
+            if self.__index is not None:
+                self.__index.mark_done(path.cog_blob_name, etag)
+
+        except Exception as e:
+            # bubble up the exception if you want the base class to abandon
+            # the message
+            raise e
 
     @sendmetrics
     def run(self, **kwargs: dict[str, Any]) -> None:
         """Execute the processor"""
 
-        import asyncio
-        import os
-        from pathlib import Path
-
-        from azure_stac.common.__blob_service import (
-            check_if_blob_exists,
-            download_blob_async,
-            upload_blob_async,
-        )
-
         # call parent method to bootstrap the required metrics
         # and hooks
         super(type(self), self).run(**kwargs)
 
-        for msg in self.begin_listening():
-            try:
-                cog_url = msg["data"]["url"]
+        # one blob service (event loop & connection pool) for the life of the processor
+        self.__blob_service = BlobService(conn_str=self.CONNECTION_STRING)
+        self.__index = self.open_idempotency_index()
 
-                file_name = Path(cog_url).name
+        with self.__blob_service, self.__index or nullcontext():
+            self.process_messages(self.__process_message)
 
-                file_name_without_ext = Path(cog_url).stem
+    def backfill(
+        self,
+        prefix: Optional[str] = None,
+        inventory_path: Optional[str] = None,
+        concurrency: Optional[int] = None,
+    ) -> Tuple[int, int, int]:
+        """Generates the previews and STAC Items of all the COGs under a prefix of the
+        source container, without going through the topic. The blobs are enumerated
+        once, from a listing or from a Blob Inventory report, and the metadata files
+        and previews are matched with their COG from that enumeration instead of
+        being checked one by one. The tiles are read in parallel and their STAC
+        Items are built BACKFILL_BATCH_SIZE at a time, see create_items. COGs already
+        processed with their current ETag are skipped
+        :param prefix: Only process the blobs whose name starts with this prefix,
+            e.g. v002/wa/2015/
+        :type prefix: str
+        :param inventory_path: Optional local path to a CSV or Parquet Blob Inventory
+            report of the source container, the container is listed otherwise
+        :type inventory_path: str
+        :param concurrency: Number of tiles processed in parallel, defaults to
+            MAX_CONCURRENCY
+        :type concurrency: int
+        :returns: Number of tiles processed, skipped as already processed, and
+            failed (in the order)
+        :rtype: Tuple[int, int, int]
+        """
 
-                # makes sure the file format is supported file format for this processor
-                if not file_name.endswith(".tif") and not file_name.endswith(".tiff"):
-                    raise TypeError(
-                        "Invalid file format. Only GeoTiff file formats are supported"
-                    )
+        from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
-                # set of temporary/intermediate variables that will be used for deriving the
-                # metadata URL, asset URL, preview URL and so on.
-                split_url, split_url_joined, _, domain_path_joined = self.__get_url_variations(
-                    cog_url
-                )
+        max_workers = concurrency or self.MAX_CONCURRENCY
+        in_flight: dict[Future, Tuple[NaipPath, Optional[str]]] = {}
+        # tiles read and waiting for their items to be built
+        pending: list[Tuple[NaipPath, Optional[str], TileDescriptor]] = []
+        processed = skipped = failed = 0
 
-                (
-                    version,
-                    state,
-                    year,
-                    state_measurement_year,
-                    folder_number,
-                ) = self.__parse_url_based_attributes(split_url)
+        def publish() -> None:
+            nonlocal processed, failed
 
-                jpeg_url = os.path.splitext(cog_url)[0] + f".{self.JPG_EXTENSION}"
+            errors = self.__publish_tiles(pending)
+            processed += len(pending) - errors
+            failed += errors
+            pending.clear()
 
-                joined_jpeg_tail_path = "/".join(jpeg_url.split("/")[4:-1])
+        def collect(done: set[Future]) -> None:
+            nonlocal failed
 
-                # az file schema URL is for use with GDAL libraries to access Storage Account
-                azure_raster_url = f"az://{self.SRC_CONTAINER_NAME}/{version}/{state}/{year}/{state_measurement_year}/{folder_number}/{file_name}"  # noqa: E501
+            for future in done:
+                path, etag = in_flight.pop(future)
+                error = future.exception()
 
-                # full download URL for the tif file
-                download_tif_url = (
-                    f"{split_url_joined}/{state_measurement_year}/{folder_number}/{file_name}"
-                )
+                if error is None:
+                    pending.append((path, etag, future.result()))
+                else:
+                    failed += 1
+                    logger.error("Failed to process %s", path.cog_url, exc_info=error)
 
-                # full download URL for metadata file that is derived from
-                # known attributes such as state
-                fdgc_metadata_url = f"{domain_path_joined}/{split_url_joined}/{state}_{self.STAC_METADATA_TYPE_NAME}_{year}/{folder_number}/{file_name_without_ext}.txt"  # noqa: E501
+            if len(pending) >= self.BACKFILL_BATCH_SIZE:
+                publish()
 
-                # full download URL for preview file that is derived from known attributes
-                jpeg_url = f"{domain_path_joined}/{joined_jpeg_tail_path}/{file_name_without_ext}.{self.JPG_EXTENSION}"  # noqa: E501
+        self.__blob_service = BlobService(conn_str=self.CONNECTION_STRING)
+        self.__index = self.open_idempotency_index()
 
-                # check if metadata file exists
-                does_metadata_file_exist = asyncio.run(
-                    check_if_blob_exists(
-                        conn_str=self.CONNECTION_STRING,
-                        container_name=self.SRC_CONTAINER_NAME,
-                        blob_name=f"{split_url_joined}/{state}_{self.STAC_METADATA_TYPE_NAME}_{year}/{folder_number}/{file_name_without_ext}.txt",  # noqa: E501
-                    )
+        with self.__blob_service, self.__index or nullcontext():
+            if inventory_path is not None:
+                blobs = read_blob_inventory(inventory_path, self.SRC_CONTAINER_NAME, prefix)
+            else:
+                blobs = self.__blob_service.run(
+                    self.__blob_service.list_blobs_async(self.SRC_CONTAINER_NAME, prefix)
                 )
 
-                # check if jpeg (preview) exists
-                does_jpeg_file_exist = asyncio.run(
-                    check_if_blob_exists(
-                        conn_str=self.CONNECTION_STRING,
-                        container_name=self.SRC_CONTAINER_NAME,
-                        blob_name=f"{joined_jpeg_tail_path}/{file_name_without_ext}.{self.JPG_EXTENSION}",  # noqa: E501
+            container_url = (
+                f"https://{self.STORAGE_ACCOUNT_NAME}.blob.core.windows.net"
+                f"/{self.SRC_CONTAINER_NAME}"
+            )
+
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for path in self.__paths.parse_many(
+                    f"{container_url}/{name}" for name in blobs
+                ):
+                    etag = blobs[path.cog_blob_name]
+
+                    if self.__index is not None and self.__index.is_done(
+                        path.cog_blob_name, etag
+                    ):
+                        skipped += 1
+                        continue
+
+                    # sidecar files are looked up in the enumeration, no request per tile
+                    future = pool.submit(
+                        self.__describe_listed_tile,
+                        path,
+                        path.metadata_blob_name in blobs,
+                        path.preview_blob_name in blobs,
                     )
-                )
+                    in_flight[future] = (path, etag)
 
-                # checks if the jpeg file exists (jpeg files are preview files for
-                # the bigger raster data) and intended to be served as one of the
-                # assets for the STAC Item
-                if not does_jpeg_file_exist:
-                    try:
-                        # todo: fix this - takes 3 arguments; not one
-                        asyncio.run(
-                            download_blob_async(
-                                conn_str=self.CONNECTION_STRING,
-                                container_name=self.SRC_CONTAINER_NAME,
-                                file_path=download_tif_url,
-                                destination_path="./",
-                            )
-                        )
-
-                        self.__translate_tif_to_jpeg(file_name_without_ext, file_name)
-
-                        # upload jpeg & aux.xml to azure storage
-                        jpeg_file_name = f"{file_name_without_ext}.{self.JPG_EXTENSION}"
-                        for file_to_upload in (
-                            jpeg_file_name,
-                            f"{jpeg_file_name}.{self.XML_EXTENSION}",
-                        ):
-                            asyncio.run(
-                                upload_blob_async(
-                                    conn_str=self.CONNECTION_STRING,
-                                    container_name=self.SRC_CONTAINER_NAME,
-                                    file_path="./",
-                                    file_name=file_to_upload,
-                                )
-                            )
-
-                    except Exception as e:
-                        # bubble up the exception if you want the base class to abandon
-                        # the message
-                        raise e
-
-                # if the metada file does not exists, we need to generate the
-                # necessary metadata before generating the STAC Item json file
-                # which will be ingested into the PostgreSQL database
-                # ------------ or ------------
-                # if the metadata file exists, the process to generate the
-                # STAC Item json file is relatively simple. Minimal metadata
-                # is generated from the raster data and then merge with the
-                # metadata provided in the metada file to generate the STAC
-                # item which will be ingested in the PostgreSQL database
-                item_id = self.__create_item_in_blob(
-                    state=state,
-                    year=year,
-                    cog_href=azure_raster_url,
-                    dst=f"https://{self.STORAGE_ACCOUNT_NAME}.blob.core.windows.net/{self.DST_CONTAINER_NAME}",  # noqa: E501
-                    stac_metadata=fdgc_metadata_url if does_metadata_file_exist else None,
-                    thumbnail=jpeg_url,
-                    providers=None,
-                    cog_url=cog_url,
-                )
+                    # keep the queue short so that huge inventories aren't held as futures
+                    if len(in_flight) >= 2 * max_workers:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
 
-                # upload stac item to blob
-                asyncio.run(
-                    upload_blob_async(
-                        conn_str=self.CONNECTION_STRING,
-                        container_name=self.DST_CONTAINER_NAME,
-                        file_name=f"{item_id}.json",
-                    )
-                )
+                collect(wait(in_flight).done)
 
-                # remove stac item from local file system
-                os.remove(f"{item_id}.json")
+                if pending:
+                    publish()
+
+        return processed, skipped, failed
 
-            except Exception as e:
-                # bubble up the exception if you want the base class to abandon
-                # the message
-                raise e
 
-            finally:
-                # printing stack trace
-                traceback.print_exc()
+def execute_processor(**settings: Any) -> None:
+    ExtractStac4mNaip(**settings).run()
 
 
-def execute_processor() -> None:
-    ExtractStac4mNaip().run()
+def execute_backfill(
+    prefix: Optional[str] = None,
+    inventory_path: Optional[str] = None,
+    concurrency: Optional[int] = None,
+) -> Tuple[int, int, int]:
+    return ExtractStac4mNaip().backfill(prefix, inventory_path, concurrency)